@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for YouTube Ad Blocker Pro
+Measures detector and service performance offline and writes the results as JSON;
+--compare checks a run against a saved baseline and fails on regressions
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import logging
+
+import numpy as np
+
+from ml_detector import AdvancedAdDetector, AD_KEYWORDS
+from page_sessions import PageSessionStore
+from text_features import TextHasher
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZES = (10, 100, 1000)
+
+# Metric name suffixes compared by --compare; others (request and error counts) are informational
+LOWER_IS_BETTER = ('_ms', '_us')
+HIGHER_IS_BETTER = ('_rps', '_per_second', '_speedup')
+
+TITLE_WORDS = ['music', 'video', 'tutorial', 'live', 'review', 'gaming', 'news', 'vlog', 'highlights', 'official']
+
+def make_elements(n, seed=0):
+    """Synthetic page elements; each one is distinct so the prediction cache cannot answer it"""
+    rng = np.random.default_rng(seed)
+    words = TITLE_WORDS + AD_KEYWORDS
+    elements = []
+    for i in range(n):
+        title = ' '.join(rng.choice(words, size=rng.integers(2, 7)))
+        elements.append({
+            'id': f'el-{seed}-{i}',
+            'title': f'{title} {i}',
+            'description': ' '.join(rng.choice(words, size=rng.integers(0, 30))),
+            'url': f'https://www.youtube.com/watch?v={i:011d}' if rng.random() > 0.1 else f'https://ad.doubleclick.net/{i}',
+            'has_ad_badge': bool(rng.random() < 0.1),
+            'is_promoted': bool(rng.random() < 0.1),
+            'duration': int(rng.integers(0, 3600)),
+            'view_count': int(rng.integers(0, 10 ** 7)),
+            'like_count': int(rng.integers(0, 10 ** 5)),
+            'comment_count': int(rng.integers(0, 10 ** 4)),
+            'channel_verified': bool(rng.random() < 0.5),
+            'subscriber_count': int(rng.integers(0, 10 ** 7)),
+            'upload_frequency': float(rng.random() * 20)
+        })
+    return elements
+
+def measure(function, repeat=7, min_time=0.02):
+    """Best seconds per call over `repeat` timings, each looping for at least min_time
+    
+    The minimum is the least noisy estimate on a shared machine, as with timeit.
+    """
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - started >= min_time:
+            break
+        number *= 2
+    
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started) / number)
+    return min(timings)
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000.0
+    return {f'p{q}_ms': float(np.percentile(latencies, q)) for q in (50, 90, 99)}
+
+def bench_extract_features(model_path, n):
+    detector = AdvancedAdDetector(cache_size=0)
+    detector.load_model(model_path)
+    elements = make_elements(n, seed=1)
+    
+    per_dict = measure(lambda: [detector.extract_features(e) for e in elements])
+    per_matrix = measure(lambda: detector.extract_feature_matrix(elements))
+    
+    # The text stage on its own, whether or not this model uses it; long
+    # descriptions run into the per-batch character budget
+    hasher = TextHasher()
+    text = measure(lambda: hasher.transform(elements))
+    long_elements = [dict(e, description=e['description'] * 50) for e in elements]
+    long_text = measure(lambda: hasher.transform(long_elements))
+    return {
+        'extract_features_per_element_us': per_dict / n * 1e6,
+        'extract_feature_matrix_per_element_us': per_matrix / n * 1e6,
+        'text_features_per_element_us': text / n * 1e6,
+        'text_features_long_per_element_us': long_text / n * 1e6
+    }
+
+def bench_single_vs_batch(model_path, n):
+    """predict_ad_probability one element at a time against one predict_batch call"""
+    detector = AdvancedAdDetector(cache_size=0)
+    detector.load_model(model_path)
+    elements = make_elements(n, seed=2)
+    
+    single = measure(lambda: [detector.predict_ad_probability(e) for e in elements])
+    batch = measure(lambda: detector.predict_batch(elements))
+    return {
+        'single_per_element_us': single / n * 1e6,
+        'batch_per_element_us': batch / n * 1e6,
+        'batch_speedup': single / batch
+    }
+
+def bench_cascade(model_path, n):
+    """Forest scoring against cascade mode, on the scoring stage and end to end"""
+    forest = AdvancedAdDetector(cache_size=0)
+    forest.load_model(model_path)
+    cascade = AdvancedAdDetector(cache_size=0, cascade=True)
+    cascade.load_model(model_path)
+    if cascade.cascade is None:
+        # Models trained before cascade mode have no stage-one table
+        return {}
+    
+    elements = make_elements(n, seed=6)
+    matrix, _, _ = forest.extract_feature_matrix(elements)
+    forest_score = measure(lambda: forest.score_matrix(matrix))
+    cascade_score = measure(lambda: cascade.score_matrix(matrix))
+    return {
+        'forest_score_per_element_us': forest_score / n * 1e6,
+        'cascade_score_per_element_us': cascade_score / n * 1e6,
+        'cascade_batch_per_element_us': measure(lambda: cascade.predict_batch(elements)) / n * 1e6,
+        'cascade_speedup': forest_score / cascade_score,
+        'fast_path_share': float(cascade.cascade.is_fast[cascade.cascade.cells(matrix)].mean())
+    }
+
+def bench_page_analysis(model_path):
+    detector = AdvancedAdDetector(cache_size=0)
+    detector.load_model(model_path)
+    
+    results = {}
+    for size in PAGE_SIZES:
+        page = {'elements': make_elements(size, seed=3)}
+        results[f'page_{size}_ms'] = measure(lambda: detector.analyze_youtube_page(page)) * 1000
+        
+        # A rescan through a page session, resending the whole page with 5% of
+        # its elements changed since the last call
+        elements = [dict(element, id=f'e{i}') for i, element in enumerate(page['elements'])]
+        changed = [dict(element, title=element.get('title', '') + ' (updated)') if i % 20 == 0 else element
+                   for i, element in enumerate(elements)]
+        sessions = PageSessionStore()
+        sessions.analyze(detector, 'bench', elements, full=True)
+        scans = itertools.cycle([changed, elements])
+        results[f'page_{size}_rescan_ms'] = measure(
+            lambda: sessions.analyze(detector, 'bench', next(scans), full=True)
+        ) * 1000
+    return results
+
+COLD_START_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from ml_detector import AdvancedAdDetector
+imported = time.perf_counter()
+detector = AdvancedAdDetector()
+detector.load_model(sys.argv[1])
+loaded = time.perf_counter()
+detector.predict_batch([{"title": "Sponsored ad", "view_count": 10}])
+print(json.dumps({"import_ms": (imported - started) * 1000, "load_ms": (loaded - imported) * 1000,
+                  "first_prediction_ms": (time.perf_counter() - loaded) * 1000}))
+'''
+
+def bench_cold_start(model_path, repeat=5):
+    """Fresh interpreter to first prediction, best of `repeat` runs"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, model_path], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+        breakdown = json.loads(output.strip().splitlines()[-1])
+        breakdown['total_ms'] = (time.perf_counter() - started) * 1000
+        runs.append(breakdown)
+    return min(runs, key=lambda run: run['total_ms'])
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def load_test(port, path, bodies, clients, duration):
+    """Keep-alive clients POSTing bodies round-robin for `duration` seconds"""
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+    
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        i = index
+        while time.perf_counter() < deadline:
+            body = bodies[i % len(bodies)]
+            i += clients
+            started = time.perf_counter()
+            try:
+                connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[index] += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                errors[index] += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                continue
+            latencies[index].append(time.perf_counter() - started)
+        connection.close()
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    
+    latencies = [latency for client_latencies in latencies for latency in client_latencies]
+    return dict(
+        requests=len(latencies),
+        errors=sum(errors),
+        requests_rps=len(latencies) / elapsed,
+        **percentiles(latencies or [0.0])
+    )
+
+def bench_service(model_path, clients, duration, batch_size, mode='threaded', processes=None):
+    """End-to-end /analyze and /batch_analyze against a local service"""
+    from python_integration import AdDetectionService, AsyncAdDetectionService, PreforkAdDetectionService
+    
+    port = free_port()
+    if mode == 'prefork':
+        service = PreforkAdDetectionService('127.0.0.1', port, model_path, processes=processes)
+    elif mode == 'async':
+        service = AsyncAdDetectionService('127.0.0.1', port, model_path)
+    else:
+        service = AdDetectionService('127.0.0.1', port, model_path)
+    if not service.start_service():
+        raise RuntimeError('Service failed to start')
+    
+    try:
+        single = [json.dumps(e).encode('utf-8') for e in make_elements(20000, seed=4)]
+        batches = [json.dumps({'elements': make_elements(batch_size, seed=5 + i)}).encode('utf-8')
+                   for i in range(50)]
+        
+        analyze = load_test(port, '/analyze', single, clients, duration)
+        batch = load_test(port, '/batch_analyze', batches, clients, duration)
+        batch['elements_per_second'] = batch['requests_rps'] * batch_size
+    finally:
+        service.stop_service()
+    
+    return {
+        **{f'analyze_{name}': value for name, value in analyze.items()},
+        **{f'batch_analyze_{name}': value for name, value in batch.items()}
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def run_benchmarks(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model_path
+        if model_path is None:
+            # A model trained on the fixed synthetic set keeps runs comparable
+            model_path = os.path.join(tmp, 'benchmark_model.pkl')
+            AdvancedAdDetector().train_model(model_path=model_path)
+        
+        results = {}
+        suites = [
+            ('extract_features', lambda: bench_extract_features(model_path, args.elements)),
+            ('single_vs_batch', lambda: bench_single_vs_batch(model_path, args.elements)),
+            ('cascade', lambda: bench_cascade(model_path, args.elements)),
+            ('page_analysis', lambda: bench_page_analysis(model_path)),
+            ('cold_start', lambda: bench_cold_start(model_path))
+        ]
+        if not args.skip_service:
+            suites.append(('service', lambda: bench_service(model_path, args.clients, args.duration,
+                                                            args.batch_size, args.service_mode,
+                                                            args.processes)))
+        
+        for name, suite in suites:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = suite()
+    
+    return {'environment': environment(), 'results': results}
+
+def compare(current, baseline, threshold):
+    """Print each shared metric's change; return the metrics that regressed beyond threshold"""
+    regressions = []
+    print(f"{'metric':<52} {'baseline':>12} {'current':>12} {'change':>9}")
+    for suite, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            base = baseline.get('results', {}).get(suite, {}).get(metric)
+            if not metric.endswith(LOWER_IS_BETTER + HIGHER_IS_BETTER) or not base:
+                continue
+            
+            change = (value - base) / abs(base)
+            worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressions.append(f'{suite}.{metric}')
+            print(f"{suite + '.' + metric:<52} {base:>12.3f} {value:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='YouTube Ad Blocker Pro benchmarks')
+    parser.add_argument('--output', help='Write results JSON here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare against a saved results JSON')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative slowdown counted as a regression (default 0.10)')
+    parser.add_argument('--model-path', help='Benchmark this model instead of one trained on synthetic data')
+    parser.add_argument('--elements', type=int, default=1000, help='Elements for the per-element benchmarks')
+    parser.add_argument('--skip-service', action='store_true', help='Skip the end-to-end service benchmark')
+    parser.add_argument('--service-mode', choices=['threaded', 'async', 'prefork'], default='threaded')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes for --service-mode prefork (default: one per CPU)')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent keep-alive clients')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per endpoint load test')
+    parser.add_argument('--batch-size', type=int, default=100, help='Elements per /batch_analyze request')
+    
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    report = run_benchmarks(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}",
+                  file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Cascade Stage for YouTube Ad Blocker Pro
+A calibrated lookup table over the strongest boolean features that answers
+obvious elements directly, so only ambiguous ones are scored by the forest
+"""
+
+import os
+import threading
+
+import numpy as np
+
+CASCADE_EXTENSION = '.cascade.json'
+
+class RuleCascade:
+    """Stage-one scorer with one calibrated probability per combination of signal features
+    
+    Every combination (cell) of the signal columns gets the smoothed share of
+    ads among the training rows that fell in it. Cells with at least
+    min_support training rows whose probability is at most `low` or at least
+    `high` are answered from the table; all other rows go to the forest.
+    """
+    
+    def __init__(self, signals, probabilities, support, low, high, schema, min_support=20, validation=None):
+        self.signals = list(signals)
+        self.probabilities = np.asarray(probabilities, dtype=np.float64)
+        self.support = np.asarray(support, dtype=np.int64)
+        self.low = low
+        self.high = high
+        self.min_support = min_support
+        self.validation = validation or {}
+        
+        self.columns = [schema.index[name] for name in self.signals]
+        self._bits = 1 << np.arange(len(self.columns))
+        self.is_fast = (self.support >= min_support) & (
+            (self.probabilities <= low) | (self.probabilities >= high)
+        )
+        
+        self.fast = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def path_for(model_path):
+        """Cascade file stored next to a joblib model file"""
+        return os.path.splitext(model_path)[0] + CASCADE_EXTENSION
+    
+    def cells(self, X):
+        return (X[:, self.columns] > 0) @ self._bits
+    
+    def split(self, X):
+        """Return (probabilities, fast mask); probabilities only mean something where fast is set"""
+        cells = self.cells(X)
+        fast = self.is_fast[cells]
+        n_fast = int(fast.sum())
+        with self._lock:
+            self.fast += n_fast
+            self.escalated += len(fast) - n_fast
+        return self.probabilities[cells], fast
+    
+    @classmethod
+    def fit(cls, schema, X_train, y_train, X_val, y_val, forest_val_probabilities, importances,
+            n_signals=7, target_accuracy=None, tolerance=0.005, threshold=0.7, min_support=20):
+        """Build the table on the training split and tune low/high on the validation split
+        
+        The signals are the n_signals boolean features the forest found most
+        important. low and high are chosen to send the largest share of
+        validation rows down the fast path while the cascade's accuracy at
+        `threshold` stays at or above target_accuracy, which defaults to the
+        forest's own validation accuracy minus tolerance.
+        """
+        boolean = [i for i, (_, dtype) in enumerate(schema.columns) if dtype == 'bool']
+        ranked = sorted(boolean, key=lambda i: importances[i], reverse=True)[:n_signals]
+        signals = [schema.names[i] for i in ranked]
+        n_cells = 1 << len(signals)
+        bits = 1 << np.arange(len(signals))
+        
+        train_cells = (X_train[:, ranked] > 0) @ bits
+        support = np.bincount(train_cells, minlength=n_cells)
+        positives = np.bincount(train_cells, weights=np.asarray(y_train, dtype=np.float64), minlength=n_cells)
+        probabilities = (positives + 1) / (support + 2)
+        
+        # Per cell: validation rows, and how many each stage would get right
+        y_val = np.asarray(y_val, dtype=bool)
+        val_cells = (X_val[:, ranked] > 0) @ bits
+        rows = np.bincount(val_cells, minlength=n_cells)
+        table_right = np.bincount(val_cells, weights=(probabilities[val_cells] >= threshold) == y_val,
+                                  minlength=n_cells)
+        forest_right = np.bincount(val_cells, weights=(forest_val_probabilities >= threshold) == y_val,
+                                   minlength=n_cells)
+        
+        n_val = max(len(y_val), 1)
+        forest_accuracy = forest_right.sum() / n_val
+        target = forest_accuracy - tolerance if target_accuracy is None else target_accuracy
+        
+        eligible = support >= min_support
+        lows = [-1.0] + sorted(set(probabilities[eligible & (probabilities < threshold)]))
+        highs = [2.0] + sorted(set(probabilities[eligible & (probabilities >= threshold)]))
+        
+        best = (0.0, forest_accuracy, -1.0, 2.0)
+        for low in lows:
+            for high in highs:
+                fast = eligible & ((probabilities <= low) | (probabilities >= high))
+                accuracy = (table_right[fast].sum() + forest_right[~fast].sum()) / n_val
+                share = rows[fast].sum() / n_val
+                if accuracy >= target and (share, accuracy) > best[:2]:
+                    best = (share, accuracy, low, high)
+        
+        share, accuracy, low, high = best
+        validation = {
+            'rows': int(len(y_val)),
+            'fast_path_share': float(share),
+            'accuracy': float(accuracy),
+            'forest_accuracy': float(forest_accuracy),
+            'target_accuracy': float(target),
+            'threshold': threshold
+        }
+        return cls(signals, probabilities, support, float(low), float(high), schema, min_support, validation)
+    
+    def to_dict(self):
+        return {
+            'signals': self.signals,
+            'probabilities': self.probabilities.tolist(),
+            'support': self.support.tolist(),
+            'low': self.low,
+            'high': self.high,
+            'min_support': self.min_support,
+            'validation': self.validation
+        }
+    
+    @classmethod
+    def from_dict(cls, data, schema):
+        return cls(data['signals'], data['probabilities'], data['support'], data['low'], data['high'],
+                   schema, data.get('min_support', 20), data.get('validation'))
+    
+    def stats(self):
+        with self._lock:
+            fast, escalated = self.fast, self.escalated
+        total = fast + escalated
+        return {
+            'signals': self.signals,
+            'low': self.low,
+            'high': self.high,
+            'fast_cells': int(self.is_fast.sum()),
+            'validation': self.validation,
+            'fast': fast,
+            'escalated': escalated,
+            'fast_path_share': fast / total if total else 0.0
+        }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Columnar Wire Format for YouTube Ad Blocker Pro
+Packs a list of flat records into typed column blocks so batch requests and
+responses skip per-element JSON keys and parsing
+"""
+
+import json
+import struct
+
+import numpy as np
+
+CONTENT_TYPE = 'application/vnd.adblocker.columnar'
+
+# Layout: magic, little-endian u32 header length, JSON header, then column
+# blocks at 8-byte aligned offsets from the start of the data region
+MAGIC = b'ADBCOLS1'
+ALIGNMENT = 8
+
+# Text values are joined with NUL; values containing it fall back to the json kind
+SEPARATOR = '\0'
+
+# Fixed-width column kinds and their block dtypes
+FIXED_DTYPES = {
+    'bool': '|u1',
+    'int': '<i8',
+    'float': '<f8'
+}
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _is_text(value):
+    return isinstance(value, str) and SEPARATOR not in value
+
+def _column_kind(values):
+    """Narrowest kind that holds every present value of a column"""
+    types = {type(value) for value in values}
+    if types <= {bool}:
+        return 'bool'
+    if types <= {int}:
+        if all(-2 ** 63 <= value < 2 ** 63 for value in values):
+            return 'int'
+        return 'json'
+    if types <= {int, float}:
+        return 'float'
+    if types <= {str}:
+        return 'text' if all(_is_text(value) for value in values) else 'json'
+    if types <= {list, tuple} and all(_is_text(item) for value in values for item in value):
+        return 'text_list'
+    return 'json'
+
+def _encode_column(kind, values):
+    """Return the column's blocks as {block name: bytes}"""
+    if kind in FIXED_DTYPES:
+        return {'data': np.asarray(values, dtype=FIXED_DTYPES[kind]).tobytes()}
+    if kind == 'text':
+        return {'data': SEPARATOR.join(values).encode('utf-8')}
+    if kind == 'text_list':
+        return {
+            'counts': np.fromiter(map(len, values), dtype='<u4', count=len(values)).tobytes(),
+            'data': SEPARATOR.join(item for value in values for item in value).encode('utf-8')
+        }
+    return {'data': SEPARATOR.join(json.dumps(value) for value in values).encode('utf-8')}
+
+def _split(data, count):
+    if count == 0:
+        return []
+    return bytes(data).decode('utf-8').split(SEPARATOR)
+
+def _decode_column(kind, blocks, n_rows):
+    if kind in FIXED_DTYPES:
+        values = np.frombuffer(blocks['data'], dtype=FIXED_DTYPES[kind], count=n_rows)
+        return values.astype(bool).tolist() if kind == 'bool' else values.tolist()
+    if kind == 'text':
+        values = _split(blocks['data'], n_rows)
+    elif kind == 'text_list':
+        counts = np.frombuffer(blocks['counts'], dtype='<u4', count=n_rows).astype(np.int64)
+        bounds = np.concatenate([[0], np.cumsum(counts)]).tolist()
+        items = _split(blocks['data'], bounds[-1])
+        values = [items[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    elif kind == 'json':
+        values = [json.loads(value) for value in _split(blocks['data'], n_rows)]
+    else:
+        raise ValueError(f"Unknown column kind: {kind}")
+    
+    if len(values) != n_rows:
+        raise ValueError(f"Column has {len(values)} values, expected {n_rows}")
+    return values
+
+def encode_rows(rows, metadata=None):
+    """Pack a list of dicts into one columnar message
+    
+    Keys missing from a row (or set to None) are recorded in a per-column
+    presence mask and are left out again when decoding.
+    """
+    names = []
+    for row in rows:
+        for name in row:
+            if name not in names:
+                names.append(name)
+    
+    columns, blocks = [], []
+    offset = 0
+    for name in names:
+        values = [row.get(name) for row in rows]
+        present = [value is not None for value in values]
+        packed = [value for value in values if value is not None]
+        kind = _column_kind(packed)
+        
+        column = {'name': name, 'kind': kind}
+        column_blocks = _encode_column(kind, packed)
+        if not all(present):
+            column_blocks['mask'] = np.asarray(present, dtype='|u1').tobytes()
+        
+        for block_name, data in column_blocks.items():
+            offset = _aligned(offset)
+            column[block_name] = [offset, len(data)]
+            blocks.append((offset, data))
+            offset += len(data)
+        columns.append(column)
+    
+    header = json.dumps({
+        'rows': len(rows),
+        'columns': columns,
+        'metadata': metadata or {}
+    }, separators=(',', ':')).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+    
+    message = bytearray(data_start + offset)
+    message[:len(MAGIC)] = MAGIC
+    message[len(MAGIC):len(MAGIC) + 4] = struct.pack('<I', len(header))
+    message[len(MAGIC) + 4:len(MAGIC) + 4 + len(header)] = header
+    for block_offset, data in blocks:
+        message[data_start + block_offset:data_start + block_offset + len(data)] = data
+    return bytes(message)
+
+def decode_rows(message):
+    """Unpack a columnar message into (rows, metadata); raises ValueError if malformed"""
+    message = memoryview(message)
+    if bytes(message[:len(MAGIC)]) != MAGIC or len(message) < len(MAGIC) + 4:
+        raise ValueError('Not a columnar message')
+    
+    header_length, = struct.unpack_from('<I', message, len(MAGIC))
+    try:
+        header = json.loads(bytes(message[len(MAGIC) + 4:len(MAGIC) + 4 + header_length]))
+        n_rows = int(header['rows'])
+        columns = list(header['columns'])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Malformed columnar header: {e}")
+    
+    data_start = _aligned(len(MAGIC) + 4 + header_length)
+    names, values, masks = [], [], []
+    for column in columns:
+        try:
+            name, kind = column['name'], column['kind']
+            blocks = {}
+            for block_name in ('data', 'counts', 'mask'):
+                if block_name in column:
+                    start, size = (int(value) for value in column[block_name])
+                    if start < 0 or size < 0 or data_start + start + size > len(message):
+                        raise ValueError(f"Column {name} runs past the end of the message")
+                    blocks[block_name] = message[data_start + start:data_start + start + size]
+            
+            mask = None
+            if 'mask' in blocks:
+                mask = np.frombuffer(blocks['mask'], dtype='|u1', count=n_rows).astype(bool)
+            column_values = _decode_column(kind, blocks, n_rows if mask is None else int(mask.sum()))
+        except (KeyError, TypeError, IndexError) as e:
+            raise ValueError(f"Malformed columnar column: {e!r}")
+        
+        names.append(name)
+        values.append(column_values)
+        masks.append(mask)
+    
+    if not any(mask is not None for mask in masks):
+        rows = [dict(zip(names, row)) for row in zip(*values)] if names else [{} for _ in range(n_rows)]
+        return rows, header.get('metadata', {})
+    
+    rows = [{} for _ in range(n_rows)]
+    for name, column_values, mask in zip(names, values, masks):
+        indices = range(n_rows) if mask is None else np.flatnonzero(mask).tolist()
+        for index, value in zip(indices, column_values):
+            rows[index][name] = value
+    return rows, header.get('metadata', {})
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Feedback Learning for YouTube Ad Blocker Pro
+Records false positive and false negative reports from the extension and folds
+them into predictions through an online correction layer over the forest
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Layout: magic, little-endian u32 header length, JSON header naming the
+# feature columns, then fixed-size records
+MAGIC = b'ADBFDBK1'
+EXTENSION = '.feedback'
+
+# Forest probabilities are clipped before taking log-odds so 0 and 1 stay finite
+PROBABILITY_EPSILON = 1e-3
+
+def record_dtype(n_features):
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('key', 'V16'),
+        ('label', '|u1'),
+        ('features', '<f4', (n_features,))
+    ])
+
+def _shared_columns(from_names, to_names):
+    """(from indices, to indices) of the columns two layouts share; the rest are dropped or read as zero"""
+    shared = [name for name in to_names if name in from_names]
+    if not shared:
+        raise ValueError(f"Feedback log columns {from_names} do not match the model's {to_names}")
+    return [from_names.index(name) for name in shared], [to_names.index(name) for name in shared]
+
+class FeedbackLog:
+    """Append-only binary log of labelled feature rows, shared by every process serving a model"""
+    
+    def __init__(self, path, names, repair=True):
+        self.path = path
+        
+        if not os.path.exists(path):
+            # Linked into place complete, so a process racing to create the
+            # same log never sees it without its header
+            header = json.dumps({'features': list(names)}, separators=(',', ':')).encode('utf-8')
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            try:
+                os.link(temp_path, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(temp_path)
+        
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a feedback log: {path}")
+            header_length, = struct.unpack('<I', f.read(4))
+            self.names = json.loads(f.read(header_length))['features']
+        self.data_start = len(MAGIC) + 4 + header_length
+        _shared_columns(self.names, list(names))
+        
+        self.dtype = record_dtype(len(self.names))
+        size = os.path.getsize(path) - self.data_start
+        if repair and size % self.dtype.itemsize:
+            # A record cut short by a crash; only safe while no other process appends
+            os.truncate(path, self.data_start + size // self.dtype.itemsize * self.dtype.itemsize)
+        
+        # Unbuffered: every append is a single write of whole records
+        self._file = open(path, 'ab', buffering=0)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def path_for(model_path):
+        """Feedback log stored next to a model file"""
+        return os.path.splitext(model_path)[0] + EXTENSION
+    
+    def __len__(self):
+        return (os.path.getsize(self.path) - self.data_start) // self.dtype.itemsize
+    
+    def append(self, keys, labels, features, names):
+        """Append one record per key; features are columns in `names` order"""
+        records = np.zeros(len(keys), dtype=self.dtype)
+        records['timestamp'] = time.time()
+        records['key'] = keys
+        records['label'] = labels
+        source, target = _shared_columns(list(names), self.names)
+        records['features'][:, target] = np.asarray(features)[:, source]
+        with self._lock:
+            self._file.write(records.tobytes())
+    
+    def read(self, names, start, stop):
+        """(keys, labels, features) of records start to stop, with features in `names` order"""
+        if start >= stop:
+            return [], np.zeros(0, dtype=np.uint8), np.zeros((0, len(names)), dtype=np.float32)
+        
+        records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.data_start, shape=(stop,))[start:]
+        source, target = _shared_columns(self.names, list(names))
+        features = np.zeros((len(records), len(names)), dtype=np.float32)
+        features[:, target] = records['features'][:, source]
+        return [bytes(key) for key in records['key']], np.array(records['label']), features
+    
+    def close(self):
+        self._file.close()
+
+class OnlineCorrector:
+    """Logistic correction of forest probabilities, fitted online to feedback reports"""
+    
+    def __init__(self, window=2048, steps=20, learning_rate=0.5, report_weight=20.0, prior_weight=100.0):
+        self.window = window
+        self.steps = steps
+        self.learning_rate = learning_rate
+        self.report_weight = report_weight
+        self.prior_weight = prior_weight
+        self.weights = None
+        self._prior = None
+        self._report_probabilities = np.zeros(0)
+        self._report_features = None
+        self._labels = np.zeros(0)
+        # Reports only arrive for mistakes; recently served rows, fitted to the
+        # forest's own score, keep the fit from moving every other prediction
+        self._anchor_probabilities = None
+        self._anchor_features = None
+        self._anchor_count = 0
+        self._anchor_next = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        """Reports in the current window"""
+        return len(self._labels)
+    
+    @staticmethod
+    def logit(probabilities):
+        probabilities = np.minimum(np.maximum(probabilities, PROBABILITY_EPSILON), 1 - PROBABILITY_EPSILON)
+        return np.log(probabilities / (1 - probabilities))
+    
+    @classmethod
+    def inputs(cls, probabilities, features):
+        return np.column_stack([
+            np.ones(len(probabilities)),
+            cls.logit(probabilities),
+            np.log1p(np.maximum(features, 0))
+        ])
+    
+    def observe(self, probabilities, features):
+        """Keep served rows as anchors, overwriting the oldest"""
+        n = min(len(probabilities), self.window)
+        if not n:
+            return
+        with self._lock:
+            if self._anchor_features is None or self._anchor_features.shape[1] != features.shape[1]:
+                self._anchor_features = np.zeros((self.window, features.shape[1]), dtype=np.float32)
+                self._anchor_probabilities = np.zeros(self.window)
+                self._anchor_count = self._anchor_next = 0
+            slots = (self._anchor_next + np.arange(n)) % self.window
+            self._anchor_features[slots] = features[-n:]
+            self._anchor_probabilities[slots] = probabilities[-n:]
+            self._anchor_next = (self._anchor_next + n) % self.window
+            self._anchor_count = min(self._anchor_count + n, self.window)
+    
+    def reset(self, score, features, labels):
+        """Refit from the identity for a new forest; score maps a feature matrix to its probabilities"""
+        with self._lock:
+            if self._anchor_count:
+                anchors = self._anchor_features[:self._anchor_count]
+                self._anchor_probabilities[:self._anchor_count] = score(anchors)
+        
+        self._report_features = np.asarray(features, dtype=np.float32)[-self.window:]
+        self._report_probabilities = score(self._report_features) if len(self._report_features) else np.zeros(0)
+        self._labels = np.asarray(labels, dtype=np.float64)[-self.window:]
+        self._prior = np.zeros(self._report_features.shape[1] + 2)
+        self._prior[1] = 1.0
+        self.weights = self._prior.copy()
+        if len(self._labels):
+            self._fit(self.steps * 10)
+    
+    def add(self, probabilities, features, labels):
+        """Add reports to the window and take `steps` gradient steps from the current weights"""
+        self._report_probabilities = np.concatenate([self._report_probabilities, probabilities])[-self.window:]
+        self._report_features = np.vstack([self._report_features, features])[-self.window:]
+        self._labels = np.concatenate([self._labels, np.asarray(labels, dtype=np.float64)])[-self.window:]
+        self._fit(self.steps)
+    
+    def _fit(self, steps):
+        with self._lock:
+            count = self._anchor_count
+            anchor_probabilities = self._anchor_probabilities[:count].copy() if count else np.zeros(0)
+            anchor_features = self._anchor_features[:count].copy() if count else self._report_features[:0]
+        
+        inputs = self.inputs(np.concatenate([self._report_probabilities, anchor_probabilities]),
+                             np.vstack([self._report_features, anchor_features]))
+        targets = np.concatenate([self._labels, anchor_probabilities])
+        sample_weights = np.concatenate([np.full(len(self._labels), self.report_weight), np.ones(count)])
+        total = sample_weights.sum() + self.prior_weight
+        
+        weights = self.weights.copy()
+        for _ in range(steps):
+            predictions = 1 / (1 + np.exp(-(inputs @ weights)))
+            gradient = inputs.T @ (sample_weights * (predictions - targets)) + self.prior_weight * (weights - self._prior)
+            weights -= self.learning_rate * gradient / total
+        # Swapped in whole, so concurrent apply calls see old or new weights
+        self.weights = weights
+    
+    def apply(self, probabilities, features):
+        """Corrected probabilities; the forest's own until there are reports"""
+        if not len(self):
+            return probabilities
+        weights = self.weights
+        log_odds = weights[0] + weights[1] * self.logit(probabilities) + np.log1p(np.maximum(features, 0)) @ weights[2:]
+        return 1 / (1 + np.exp(-log_odds))
+
+class FeedbackLearner:
+    """Feedback log, per-element overrides and the online correction for the live detector"""
+    
+    max_overrides = 50000
+    
+    def __init__(self, path, window=2048, steps=20):
+        self.path = path
+        self.log = None
+        self.corrector = OnlineCorrector(window, steps)
+        self.overrides = OrderedDict()
+        self.version = 0
+        # Log records already folded in; the rest were appended by other processes
+        self._applied = 0
+        self._detector = None
+        self._lock = threading.Lock()
+    
+    def attach(self, detector):
+        """Start correcting a newly loaded detector's predictions"""
+        names = detector.schema.names
+        with self._lock:
+            if self.log is None and os.path.exists(self.path):
+                self.log = FeedbackLog(self.path, names)
+                self._applied = len(self.log)
+                keys, labels, _ = self.log.read(names, max(0, self._applied - self.max_overrides), self._applied)
+                for key, label in zip(keys, labels):
+                    self._override(key, label)
+            
+            if self.log is not None:
+                _, labels, features = self.log.read(names, max(0, self._applied - self.corrector.window),
+                                                    self._applied)
+            else:
+                labels, features = np.zeros(0), detector.schema.empty(0)
+            self.corrector.reset(detector.score_matrix, features, labels)
+            self._detector = detector
+        
+        detector.feedback = self
+        if len(labels):
+            logger.info(f"Replayed {len(labels)} feedback reports into model corrections")
+    
+    def _override(self, key, label):
+        self.overrides[key] = float(label)
+        self.overrides.move_to_end(key)
+        while len(self.overrides) > self.max_overrides:
+            self.overrides.popitem(last=False)
+    
+    def correct(self, probabilities, features, keys=None):
+        """Corrected probabilities for rows the forest just scored"""
+        self.corrector.observe(probabilities, features)
+        return self._corrected(probabilities, features, keys)
+    
+    def _corrected(self, probabilities, features, keys=None):
+        corrected = self.corrector.apply(probabilities, features)
+        if keys is not None and self.overrides:
+            corrected = np.array(corrected, dtype=np.float64)
+            for i, key in enumerate(keys):
+                label = self.overrides.get(key)
+                if label is not None:
+                    corrected[i] = label
+        return corrected
+    
+    def submit(self, elements, labels):
+        """Log reports and apply them to the attached detector; raises ValueError for a bad element"""
+        from ml_detector import PredictionCache
+        
+        detector = self._detector
+        if detector is None:
+            raise RuntimeError('No model attached')
+        
+        features, valid, errors = detector.extract_feature_matrix(elements)
+        if errors:
+            index, error = next(iter(errors.items()))
+            raise ValueError(f"Element {index}: {error}")
+        
+        keys = [PredictionCache.key_for(element) for element in elements]
+        labels = np.asarray(labels, dtype=np.uint8)
+        probabilities = detector.score_matrix(features)
+        
+        with self._lock:
+            if self.log is None:
+                # Created on the first report, so a service that never gets any leaves no file
+                self.log = FeedbackLog(self.path, detector.schema.names)
+            before = self._corrected(probabilities, features, keys)
+            self.log.append(keys, labels, features, detector.schema.names)
+            self._catch_up(detector)
+            after = self._corrected(probabilities, features)
+        
+        detector.predictions_changed()
+        return [
+            {
+                'element_id': element.get('id'),
+                'is_ad': bool(label),
+                'forest_confidence': float(forest),
+                'confidence_before': float(old),
+                'correction_confidence': float(new)
+            }
+            for element, label, forest, old, new in zip(elements, labels, probabilities, before, after)
+        ]
+    
+    def refresh(self):
+        """Fold in reports other processes appended to the log; returns how many"""
+        detector = self._detector
+        if detector is None:
+            return 0
+        
+        with self._lock:
+            if self.log is None:
+                if not os.path.exists(self.path):
+                    return 0
+                self.log = FeedbackLog(self.path, detector.schema.names, repair=False)
+            applied = self._catch_up(detector)
+        
+        if applied:
+            detector.predictions_changed()
+        return applied
+    
+    def _catch_up(self, detector):
+        """Apply log records past _applied, our own appends included; call with the lock held"""
+        count = len(self.log)
+        if count <= self._applied:
+            return 0
+        
+        keys, labels, features = self.log.read(detector.schema.names, self._applied, count)
+        for key, label in zip(keys, labels):
+            self._override(key, label)
+        self.corrector.add(detector.score_matrix(features), features, labels)
+        self._applied = count
+        self.version += 1
+        return len(labels)
+    
+    def stats(self):
+        return {
+            'reports': len(self.log) if self.log is not None else 0,
+            'overrides': len(self.overrides),
+            'window': len(self.corrector),
+            'version': self.version
+        }
+    
+    def close(self):
+        if self.log is not None:
+            self.log.close()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Packed Forest Engine for YouTube Ad Blocker Pro
+Stores a trained random forest as flat numpy arrays in a single memory-mappable file
+and evaluates it with numpy alone, so serving never needs scikit-learn
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+PACKED_EXTENSION = '.forest'
+
+# File layout: magic, little-endian u64 header length, JSON header, then each
+# array at a 64-byte aligned offset so it can be viewed straight from the mapping
+MAGIC = b'ADBFRST1'
+ALIGNMENT = 64
+
+# Node arrays every packed forest carries, with their on-disk dtypes
+ARRAY_DTYPES = {
+    'feature': '<i4',
+    'threshold': '<f8',
+    'children_left': '<i4',
+    'children_right': '<i4',
+    'value': '<f8',
+    'roots': '<i4',
+    'classes': '<i8'
+}
+
+# PackedForest attribute holding each array
+ARRAY_ATTRIBUTES = {name: name for name in ARRAY_DTYPES}
+ARRAY_ATTRIBUTES['classes'] = 'classes_'
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class PackedForest:
+    """Inference-only forest evaluated from flat node arrays
+    
+    All trees are concatenated into one node table. Leaves have feature -1 and
+    store the class probabilities in `value`; child indices are global.
+    """
+    
+    # Rows evaluated per step; bounds the (trees x rows) working arrays
+    chunk_size = 4096
+    
+    def __init__(self, arrays, metadata=None):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children_left = arrays['children_left']
+        self.children_right = arrays['children_right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.classes_ = arrays['classes']
+        self.metadata = metadata or {}
+        self.n_features_in_ = self.metadata.get('n_features', int(self.feature.max()) + 1)
+        self._compile()
+    
+    def _compile(self):
+        """Build the branch-free evaluation tables
+        
+        Leaves become self-loops testing feature 0, so every (tree, row) pair can
+        take exactly max_depth steps with no leaf masking. Children are
+        interleaved so one gather at 2 * node + went_right picks the next node.
+        These tables are small and private to the process; the large arrays
+        stay shared in the mapping.
+        """
+        is_leaf = self.feature < 0
+        nodes = np.arange(self.n_nodes, dtype=np.int32)
+        
+        self._step_feature = np.where(is_leaf, 0, self.feature).astype(np.int32)
+        self._step_children = np.stack([
+            np.where(is_leaf, nodes, self.children_left),
+            np.where(is_leaf, nodes, self.children_right)
+        ], axis=1).ravel().astype(np.int32)
+        self._roots = np.asarray(self.roots, dtype=np.int32)
+        
+        if 'max_depth' in self.metadata:
+            self.max_depth = int(self.metadata['max_depth'])
+        else:
+            self.max_depth = self._measure_depth(is_leaf)
+    
+    def _measure_depth(self, is_leaf):
+        """Depth of the deepest tree, for artifacts written without it"""
+        depth = 0
+        frontier = self._roots[~is_leaf[self._roots]]
+        while len(frontier):
+            depth += 1
+            children = np.concatenate([self.children_left[frontier], self.children_right[frontier]])
+            frontier = children[~is_leaf[children]]
+        return depth
+    
+    @property
+    def n_trees(self):
+        return len(self.roots)
+    
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+    
+    @staticmethod
+    def path_for(model_path):
+        """Packed artifact stored next to a model file"""
+        if model_path.endswith(PACKED_EXTENSION):
+            return model_path
+        return os.path.splitext(model_path)[0] + PACKED_EXTENSION
+    
+    @classmethod
+    def from_model(cls, model, metadata=None):
+        """Flatten a fitted scikit-learn forest (or return an already packed one)"""
+        if isinstance(model, cls):
+            return model
+        
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left == -1
+            
+            roots.append(offset)
+            features.append(np.where(is_leaf, -1, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, -1, tree.children_left + offset))
+            rights.append(np.where(is_leaf, -1, tree.children_right + offset))
+            
+            # Per-node class probabilities, as each tree's predict_proba reports them
+            node_values = tree.value[:, 0, :]
+            totals = node_values.sum(axis=1, keepdims=True)
+            values.append(node_values / np.where(totals == 0, 1, totals))
+            
+            offset += tree.node_count
+        
+        arrays = {
+            'feature': np.concatenate(features),
+            'threshold': np.concatenate(thresholds),
+            'children_left': np.concatenate(lefts),
+            'children_right': np.concatenate(rights),
+            'value': np.concatenate(values),
+            'roots': np.array(roots),
+            'classes': np.asarray(model.classes_)
+        }
+        arrays = {name: np.ascontiguousarray(array, dtype=ARRAY_DTYPES[name]) for name, array in arrays.items()}
+        
+        metadata = dict(
+            metadata or {},
+            n_features=int(model.n_features_in_),
+            max_depth=max(int(estimator.tree_.max_depth) for estimator in model.estimators_)
+        )
+        return cls(arrays, metadata)
+    
+    def write(self, f):
+        """Write the artifact to an open binary file"""
+        arrays = {name: np.ascontiguousarray(getattr(self, attr), dtype=ARRAY_DTYPES[name])
+                  for name, attr in ARRAY_ATTRIBUTES.items()}
+        
+        # Offsets are relative to the start of the data region
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            offset = _aligned(offset)
+            layout[name] = {'dtype': ARRAY_DTYPES[name], 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes
+        
+        header = json.dumps({'metadata': self.metadata, 'arrays': layout}).encode('utf-8')
+        data_start = _aligned(len(MAGIC) + 8 + len(header))
+        
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(b'\0' * (data_start - len(MAGIC) - 8 - len(header)))
+        
+        position = 0
+        for name, array in arrays.items():
+            f.write(b'\0' * (layout[name]['offset'] - position))
+            f.write(array.tobytes())
+            position = layout[name]['offset'] + array.nbytes
+    
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.write(f)
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open an artifact; with mmap the arrays are read-only views of the page cache"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a packed forest artifact: {path}")
+            header_length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        if mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            start = data_start + spec['offset']
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            # Plain ndarray views keep the mapping alive without memmap's per-op overhead
+            arrays[name] = np.asarray(buffer[start:start + count * dtype.itemsize]).view(dtype).reshape(spec['shape'])
+        
+        return cls(arrays, header['metadata'])
+    
+    def predict_proba(self, X):
+        """Average per-tree class probabilities for a batch of rows"""
+        # Same float32 comparison the scikit-learn trees use
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[-1]} features, but the forest expects {self.n_features_in_}")
+        
+        proba = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), self.chunk_size):
+            chunk = X[start:start + self.chunk_size]
+            proba[start:start + len(chunk)] = self._predict_chunk(chunk)
+        return proba
+    
+    def _predict_chunk(self, X):
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        
+        # One (trees x rows) node table, advanced one level per step for all trees at once
+        node = np.repeat(self._roots[:, None], n_rows, axis=1)
+        row_offset = (np.arange(n_rows, dtype=np.int64) * n_features)[None, :]
+        
+        for _ in range(self.max_depth):
+            x = flat_X[row_offset + self._step_feature[node]]
+            node = self._step_children[2 * node + (x > self.threshold[node])]
+        
+        return self.value[node].mean(axis=0)
+    
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
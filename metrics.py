@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Service Metrics for YouTube Ad Blocker Pro
+Request counts, latency and stage histograms for the ML service, exposed in the
+Prometheus text format
+"""
+
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds; requests and stages share them
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Elements per forest evaluation
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+# Hot-path stages, reported even before they are first observed
+STAGES = ('json_decode', 'columnar_decode', 'extract_features', 'predict_proba', 'get_reasoning',
+          'json_encode', 'columnar_encode')
+
+class Histogram:
+    """Fixed-bucket histogram; observe is a bisect and two additions under a lock"""
+    
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+    
+    def state(self):
+        """Return [per-bucket counts including +Inf, sum]"""
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def _render_histogram(lines, name, buckets, state, **labels):
+    counts, total = state
+    running = 0
+    for bound, count in zip(buckets + ('+Inf',), counts):
+        running += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {running}')
+    label_text = _labels(**labels) if labels else ''
+    lines.append(f'{name}_sum{label_text} {total}')
+    lines.append(f'{name}_count{label_text} {running}')
+
+def _add_states(a, b):
+    if a is None:
+        return [list(b[0]), b[1]]
+    return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1]]
+
+def _add_stats(a, b):
+    if a is None or b is None:
+        return dict(b) if a is None and b is not None else a
+    return {key: a.get(key, 0) + value for key, value in b.items()}
+
+def merge_snapshots(snapshots):
+    """Sum ServiceMetrics snapshots, e.g. from several processes; model state comes from the first"""
+    merged = {'requests': [], 'latency': {}, 'stages': {}, 'batch_sizes': None, 'in_flight': 0, 'rejected': 0,
+              'model': None, 'cache': None, 'cascade': None, 'page_sessions': None}
+    requests = {}
+    for snapshot in snapshots:
+        for method, endpoint, status, count in snapshot['requests']:
+            requests[(method, endpoint, status)] = requests.get((method, endpoint, status), 0) + count
+        for name in ('latency', 'stages'):
+            for key, state in snapshot[name].items():
+                merged[name][key] = _add_states(merged[name].get(key), state)
+        merged['batch_sizes'] = _add_states(merged['batch_sizes'], snapshot['batch_sizes'])
+        merged['in_flight'] += snapshot['in_flight']
+        merged['rejected'] += snapshot['rejected']
+        merged['model'] = merged['model'] or snapshot['model']
+        for name in ('cache', 'cascade', 'page_sessions'):
+            merged[name] = _add_stats(merged[name], snapshot[name])
+    merged['requests'] = [[*key, count] for key, count in requests.items()]
+    return merged
+
+def retired_snapshot(snapshot):
+    """A snapshot of a process that has exited: its counters stay, its gauges drop to zero"""
+    retired = dict(snapshot, in_flight=0, model=None)
+    for name, gauge in (('cache', 'size'), ('page_sessions', 'sessions')):
+        if retired[name] is not None:
+            retired[name] = dict(retired[name], **{gauge: 0})
+    return retired
+
+class ServiceMetrics:
+    """Counters and histograms shared by every request handler of a service"""
+    
+    prefix = 'adblock_ml'
+    
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.stages = {stage: Histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+    
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+    
+    def request_rejected(self):
+        """Count a connection turned away with 503 before its request was read"""
+        with self._lock:
+            self.rejected += 1
+    
+    def request_finished(self, method, endpoint, status, seconds):
+        key = (method, endpoint, str(status))
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get(endpoint)
+            if histogram is None:
+                histogram = self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(seconds)
+    
+    def observe_stages(self, timings):
+        """Record a {stage: seconds} dict collected while serving one request or batch"""
+        for stage, seconds in timings.items():
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                with self._lock:
+                    histogram = self.stages.setdefault(stage, Histogram(LATENCY_BUCKETS))
+            histogram.observe(seconds)
+    
+    def observe_batch(self, size):
+        self.batch_sizes.observe(size)
+    
+    def snapshot(self, registry=None):
+        """Every metric as JSON-able data, plus model state from the registry; see merge_snapshots"""
+        with self._lock:
+            requests = [[*key, count] for key, count in self.requests.items()]
+            latency = list(self.latency.items())
+            stages = list(self.stages.items())
+            in_flight = self.in_flight
+            rejected = self.rejected
+        
+        snapshot = {
+            'requests': requests,
+            'latency': {endpoint: histogram.state() for endpoint, histogram in latency},
+            'stages': {stage: histogram.state() for stage, histogram in stages},
+            'batch_sizes': self.batch_sizes.state(),
+            'in_flight': in_flight,
+            'rejected': rejected,
+            'model': None,
+            'cache': None,
+            'cascade': None,
+            'page_sessions': None
+        }
+        
+        if registry is not None:
+            detector = registry.get()
+            snapshot['model'] = {'loaded': int(registry.is_loaded), 'version': registry.version}
+            cache = detector.cache if detector is not None else None
+            if cache is not None:
+                stats = cache.stats()
+                snapshot['cache'] = {'hits': stats['hits'], 'misses': stats['misses'], 'size': stats['size']}
+            cascade = detector.cascade if detector is not None and detector.use_cascade else None
+            if cascade is not None:
+                stats = cascade.stats()
+                snapshot['cascade'] = {'fast': stats['fast'], 'escalated': stats['escalated']}
+            stats = registry.page_sessions.stats()
+            snapshot['page_sessions'] = {'scored': stats['scored'], 'skipped': stats['skipped'],
+                                         'sessions': stats['sessions']}
+        
+        return snapshot
+    
+    def render(self, registry=None):
+        """Prometheus text exposition of every metric, plus model state from the registry"""
+        return self.render_snapshot(self.snapshot(registry))
+    
+    def render_snapshot(self, snapshot):
+        p = self.prefix
+        
+        lines = [
+            f'# HELP {p}_requests_total HTTP requests served, by endpoint and status',
+            f'# TYPE {p}_requests_total counter'
+        ]
+        for method, endpoint, status, count in sorted(snapshot['requests']):
+            lines.append(f'{p}_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {count}')
+        
+        lines += [
+            f'# HELP {p}_request_duration_seconds Time from parsed request to response written',
+            f'# TYPE {p}_request_duration_seconds histogram'
+        ]
+        for endpoint, state in sorted(snapshot['latency'].items()):
+            _render_histogram(lines, f'{p}_request_duration_seconds', LATENCY_BUCKETS, state, endpoint=endpoint)
+        
+        lines += [
+            f'# HELP {p}_stage_duration_seconds Time spent in each hot-path stage',
+            f'# TYPE {p}_stage_duration_seconds histogram'
+        ]
+        for stage, state in sorted(snapshot['stages'].items()):
+            _render_histogram(lines, f'{p}_stage_duration_seconds', LATENCY_BUCKETS, state, stage=stage)
+        
+        lines += [
+            f'# HELP {p}_batch_size Elements per forest evaluation request',
+            f'# TYPE {p}_batch_size histogram'
+        ]
+        _render_histogram(lines, f'{p}_batch_size', BATCH_SIZE_BUCKETS, snapshot['batch_sizes'])
+        
+        lines += [
+            f'# HELP {p}_requests_in_flight Requests currently being served',
+            f'# TYPE {p}_requests_in_flight gauge',
+            f'{p}_requests_in_flight {snapshot["in_flight"]}',
+            f'# HELP {p}_requests_rejected_total Connections refused with 503 because the queue was full',
+            f'# TYPE {p}_requests_rejected_total counter',
+            f'{p}_requests_rejected_total {snapshot["rejected"]}'
+        ]
+        
+        model = snapshot['model']
+        if model is not None:
+            lines += [
+                f'# HELP {p}_model_loaded Whether a model is serving',
+                f'# TYPE {p}_model_loaded gauge',
+                f'{p}_model_loaded {model["loaded"]}',
+                f'# HELP {p}_model_version Version of the serving model',
+                f'# TYPE {p}_model_version gauge',
+                f'{p}_model_version {model["version"]}'
+            ]
+            
+            stats = snapshot['cache']
+            if stats is not None:
+                lines += [
+                    f'# HELP {p}_prediction_cache_hits_total Predictions answered from the cache',
+                    f'# TYPE {p}_prediction_cache_hits_total counter',
+                    f'{p}_prediction_cache_hits_total {stats["hits"]}',
+                    f'# HELP {p}_prediction_cache_misses_total Predictions that had to be scored',
+                    f'# TYPE {p}_prediction_cache_misses_total counter',
+                    f'{p}_prediction_cache_misses_total {stats["misses"]}',
+                    f'# HELP {p}_prediction_cache_entries Predictions currently cached',
+                    f'# TYPE {p}_prediction_cache_entries gauge',
+                    f'{p}_prediction_cache_entries {stats["size"]}'
+                ]
+            
+            stats = snapshot['cascade']
+            if stats is not None:
+                lines += [
+                    f'# HELP {p}_cascade_elements_total Elements scored in cascade mode, by the stage that answered',
+                    f'# TYPE {p}_cascade_elements_total counter',
+                    f'{p}_cascade_elements_total{_labels(stage="rules")} {stats["fast"]}',
+                    f'{p}_cascade_elements_total{_labels(stage="forest")} {stats["escalated"]}'
+                ]
+            
+            stats = snapshot['page_sessions']
+            lines += [
+                f'# HELP {p}_page_elements_total Elements sent to /analyze_page, by whether they had to be scored',
+                f'# TYPE {p}_page_elements_total counter',
+                f'{p}_page_elements_total{_labels(result="scored")} {stats["scored"]}',
+                f'{p}_page_elements_total{_labels(result="unchanged")} {stats["skipped"]}',
+                f'# HELP {p}_page_sessions Page sessions currently held for /analyze_page',
+                f'# TYPE {p}_page_sessions gauge',
+                f'{p}_page_sessions {stats["sessions"]}'
+            ]
+        
+        return '\n'.join(lines) + '\n'
@@ -5,163 +5,847 @@ Uses machine learning to identify and classify YouTube ads with high accuracy
 """
 
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report
-import joblib
+import csv
+import hashlib
 import json
+import os
 import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import itertools
 import logging
+import math
+import multiprocessing
+
+from cascade import RuleCascade
+from forest_engine import PackedForest, PACKED_EXTENSION
+from text_features import TextHasher, TEXT_FEATURE_WIDTH
+from url_rules import load_rule_engine
+
+# pandas, scikit-learn and joblib are imported where training or joblib
+# models need them, so the serving path only ever loads numpy
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Model versions are unique across detectors, so state keyed on a version
+# (cached predictions, page sessions) never outlives a hot-swapped model
+_model_versions = itertools.count(1)
+
+def atomic_write(path, write, mode='wb'):
+    """Write a file through a temp file in the same directory and rename it into place
+    
+    Readers see either the old file or the complete new one, never a partial write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+# Training column order; every model is fitted, saved and scored against this
+# layout, followed by the text columns in models that have them
+FEATURE_COLUMNS = [
+    ('has_ad_keywords', 'bool'),
+    ('has_sponsored_text', 'bool'),
+    ('title_contains_ad', 'bool'),
+    ('has_ad_badge', 'bool'),
+    ('is_promoted', 'bool'),
+    ('video_duration_short', 'bool'),
+    ('description_length', 'int'),
+    ('channel_verified', 'bool'),
+    ('view_count_low', 'bool'),
+    ('like_ratio_low', 'bool'),
+    ('comment_count_low', 'bool'),
+    ('upload_frequency_high', 'bool'),
+    ('url_has_ad_patterns', 'bool')
+]
+
+# Hashed title and description n-grams, projected by text_features.TextHasher
+TEXT_FEATURE_COLUMNS = [(f'text_hash_{i}', 'float') for i in range(TEXT_FEATURE_WIDTH)]
+TEXT_FEATURE_NAMES = frozenset(name for name, _ in TEXT_FEATURE_COLUMNS)
+
+AD_KEYWORDS = ['ad', 'advertisement', 'sponsored', 'promotion', 'paid', 'commercial']
+AD_URL_PATTERNS = ['doubleclick', 'googleads', 'youtube.com/ads', 'advertising']
+
+# Keyword scans stop here; YouTube caps descriptions at 5000 characters
+MAX_SCANNED_TEXT_CHARS = 5000
+
+# Lowercases ASCII letters and digits and maps every other byte to a space,
+# so word boundaries become single spaces a compiled pattern can anchor on
+_WORD_TABLE = bytes(
+    c + 32 if 65 <= c <= 90 else c if (97 <= c <= 122 or 48 <= c <= 57) else 32
+    for c in range(256)
+)
+
+class TermMatcher:
+    """Finds every configured term in a text field with one compiled scan"""
+    
+    def __init__(self, terms, whole_words=True, max_chars=None):
+        self.terms = tuple(terms)
+        self.whole_words = whole_words
+        self.max_chars = max_chars
+        self._needles = tuple(term.lower() for term in self.terms)
+        
+        # Longest first so overlapping terms report the most specific hit
+        alternation = b'|'.join(
+            re.escape(term.lower().encode('utf-8'))
+            for term in sorted(self.terms, key=len, reverse=True)
+        )
+        if whole_words:
+            # Allow a plural "s"; the lookahead leaves the next term matchable
+            self._pattern = re.compile(b' (' + alternation + b')s?(?= )')
+        else:
+            self._pattern = re.compile(b'(' + alternation + b')')
+    
+    def find(self, text):
+        """Return the set of terms that occur in text"""
+        if not text:
+            return frozenset()
+        if self.max_chars is not None:
+            text = text[:self.max_chars]
+        
+        # Plain substring checks run in C and rule out most fields without a scan
+        low = text.lower()
+        if not any(needle in low for needle in self._needles):
+            return frozenset()
+        
+        data = low.encode('utf-8', 'ignore')
+        if self.whole_words:
+            data = b' ' + data.translate(_WORD_TABLE) + b' '
+        
+        return frozenset(term.decode('utf-8') for term in self._pattern.findall(data))
+
+KEYWORD_MATCHER = TermMatcher(AD_KEYWORDS, max_chars=MAX_SCANNED_TEXT_CHARS)
+URL_PATTERN_MATCHER = TermMatcher(AD_URL_PATTERNS, whole_words=False)
+
+# Share of synthetic samples with each boolean feature set
+SYNTHETIC_FEATURE_RATES = {
+    'has_ad_keywords': 0.3,
+    'has_sponsored_text': 0.2,
+    'title_contains_ad': 0.25,
+    'has_ad_badge': 0.15,
+    'is_promoted': 0.2,
+    'video_duration_short': 0.4,
+    'channel_verified': 0.3,
+    'view_count_low': 0.3,
+    'like_ratio_low': 0.35,
+    'comment_count_low': 0.4,
+    'upload_frequency_high': 0.25,
+    'url_has_ad_patterns': 0.1
+}
+
+# The extension's network rules; URLs they block count as ad URLs
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+
+# Forest settings used unless a hyperparameter search picks others
+DEFAULT_FOREST_PARAMS = {
+    'n_estimators': 100,
+    'max_depth': 10,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2
+}
+
+# Rows train_model reads from a feature store unless told otherwise, about
+# 300 MB with the text columns; larger stores are randomly subsampled
+DEFAULT_MAX_TRAINING_ROWS = 1000000
+
+# Candidates for train_model(search=True); unlisted settings come from DEFAULT_FOREST_PARAMS
+SEARCH_GRID = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [6, 8, 10, 14],
+    'min_samples_leaf': [1, 2, 5]
+}
+
+# Per-process training data for search workers, set once by the pool initializer
+_search_data = None
+
+def _init_search_worker(X, y):
+    global _search_data
+    _search_data = (X, y)
+
+def _evaluate_candidate(params, n_rows, cv, seed):
+    """Cross-validate one candidate on the first n_rows of the shuffled search data
+    
+    Returns (mean accuracy, mean inference cost). Cost is tree count x deepest
+    tree, the number of node steps PackedForest takes per row.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import StratifiedKFold
+    
+    X, y = _search_data
+    X, y = X[:n_rows], y[:n_rows]
+    
+    scores, costs = [], []
+    for train, test in StratifiedKFold(n_splits=cv, shuffle=True, random_state=seed).split(X, y):
+        model = RandomForestClassifier(random_state=seed, n_jobs=1, **params).fit(X[train], y[train])
+        scores.append(model.score(X[test], y[test]))
+        costs.append(model.n_estimators * max(int(e.tree_.max_depth) for e in model.estimators_))
+    
+    return float(np.mean(scores)), float(np.mean(costs))
+
+class FeatureSchema:
+    """Column order and dtypes shared by training, feature extraction and inference"""
+    
+    # Feature matrices are float32, the dtype the forest evaluates internally
+    matrix_dtype = np.float32
+    
+    def __init__(self, columns=None):
+        self.columns = [tuple(column) for column in (columns or FEATURE_COLUMNS + TEXT_FEATURE_COLUMNS)]
+        self.names = [name for name, _ in self.columns]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        
+        # Models saved before text features existed have only the core columns
+        core = {name for name, _ in FEATURE_COLUMNS}
+        if len(self.index) != len(self.names) or set(self.names) not in (core, core | TEXT_FEATURE_NAMES):
+            raise ValueError(f"Incompatible feature schema: {self.names}")
+        
+        # Text columns in TextHasher output order; empty without text features
+        self.text_columns = [self.index[name] for name, _ in TEXT_FEATURE_COLUMNS if name in self.index]
+    
+    def __len__(self):
+        return len(self.columns)
+    
+    def empty(self, n_rows):
+        """Allocate a zeroed feature matrix for n_rows elements"""
+        return np.zeros((n_rows, len(self.columns)), dtype=self.matrix_dtype)
+    
+    def row_to_dict(self, row):
+        """Convert one feature row back to named Python values"""
+        return {
+            name: bool(row[i]) if dtype == 'bool' else float(row[i]) if dtype == 'float' else int(row[i])
+            for i, (name, dtype) in enumerate(self.columns)
+        }
+    
+    def to_dict(self):
+        return {'columns': [list(column) for column in self.columns]}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['columns'])
+    
+    @staticmethod
+    def path_for(model_path):
+        """Schema file stored next to a model file"""
+        return os.path.splitext(model_path)[0] + '.schema.json'
+    
+    def save(self, path):
+        atomic_write(path, lambda f: json.dump(self.to_dict(), f, indent=2), mode='w')
+    
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+# Element fields that influence extract_features; only these feed the cache key
+CACHE_KEY_FIELDS = (
+    'title', 'description', 'url', 'has_ad_badge', 'is_promoted', 'duration',
+    'channel_verified', 'view_count', 'like_count', 'comment_count', 'upload_frequency'
+)
+
+class PredictionCache:
+    """Bounded LRU cache of element predictions with a TTL and model-version check"""
+    
+    def __init__(self, max_size=4096, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key_for(element_data):
+        """Stable content hash of the feature-relevant fields of an element"""
+        fields = [element_data.get(field) for field in CACHE_KEY_FIELDS]
+        encoded = json.dumps(fields, separators=(',', ':'), default=str).encode('utf-8')
+        return hashlib.blake2b(encoded, digest_size=16).digest()
+    
+    def get(self, key, model_version):
+        """Return the cached (probability, reasoning) or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != model_version or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, key, model_version, value):
+        with self._lock:
+            self._entries[key] = (model_version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+# Raw element log fields that CSV delivers as text and extract_features reads as numbers/flags
+NUMERIC_ELEMENT_FIELDS = ('duration', 'view_count', 'like_count', 'comment_count',
+                          'subscriber_count', 'upload_frequency')
+BOOLEAN_ELEMENT_FIELDS = ('has_ad_badge', 'is_promoted', 'channel_verified')
+TRUE_STRINGS = {'1', 'true', 'yes', 't', 'y'}
+FALSE_STRINGS = {'0', 'false', 'no', 'f', 'n', ''}
+
+def parse_flag(value):
+    """Parse a label or boolean field from JSON or CSV text"""
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return True
+    if text in FALSE_STRINGS:
+        return False
+    raise ValueError(f"Not a boolean value: {value!r}")
+
+class IngestReport:
+    """Counts and sample errors from a training-log ingest"""
+    
+    max_errors_kept = 20
+    
+    def __init__(self, source):
+        self.source = source
+        self.rows_read = 0
+        self.rows_ingested = 0
+        self.rows_skipped = 0
+        self.errors = []
+    
+    def skip(self, line_number, message):
+        self.rows_skipped += 1
+        if len(self.errors) < self.max_errors_kept:
+            self.errors.append({'line': line_number, 'error': message})
+    
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'rows_read': self.rows_read,
+            'rows_ingested': self.rows_ingested,
+            'rows_skipped': self.rows_skipped,
+            'errors': self.errors
+        }
+
+class FeatureStore:
+    """On-disk feature matrix and labels with fixed dtypes, memory-mapped for training"""
+    
+    FEATURES_FILE = 'features.f32'
+    LABELS_FILE = 'labels.u1'
+    META_FILE = 'meta.json'
+    
+    def __init__(self, directory, schema, n_rows=0, meta=None):
+        self.directory = directory
+        self.schema = schema
+        self.n_rows = n_rows
+        self.meta = meta or {}
+        self._features_file = None
+        self._labels_file = None
+    
+    @classmethod
+    def exists(cls, directory):
+        return os.path.exists(os.path.join(directory, cls.META_FILE))
+    
+    @classmethod
+    def create(cls, directory, schema, source=None):
+        """Start a new store for appending, replacing any previous contents"""
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, cls.META_FILE)
+        if os.path.exists(meta_path):
+            os.unlink(meta_path)
+        
+        store = cls(directory, schema, meta={'source': source})
+        store._features_file = open(os.path.join(directory, cls.FEATURES_FILE), 'wb')
+        store._labels_file = open(os.path.join(directory, cls.LABELS_FILE), 'wb')
+        return store
+    
+    def append(self, features, labels):
+        """Append a chunk of feature rows and their labels"""
+        self._features_file.write(np.ascontiguousarray(features, dtype=self.schema.matrix_dtype).tobytes())
+        self._labels_file.write(np.ascontiguousarray(labels, dtype=np.uint8).tobytes())
+        self.n_rows += len(labels)
+    
+    def close(self, report=None):
+        """Flush the data files and publish meta.json"""
+        self._features_file.close()
+        self._labels_file.close()
+        self.meta.update({
+            'n_rows': self.n_rows,
+            'schema': self.schema.to_dict(),
+            'created': datetime.now().isoformat(),
+            'ingest': report.to_dict() if report else None
+        })
+        atomic_write(os.path.join(self.directory, self.META_FILE),
+                     lambda f: json.dump(self.meta, f, indent=2), mode='w')
+    
+    @classmethod
+    def open(cls, directory):
+        """Open a finished store; returns (store, X, y) with memory-mapped X and y"""
+        with open(os.path.join(directory, cls.META_FILE)) as f:
+            meta = json.load(f)
+        
+        schema = FeatureSchema.from_dict(meta['schema'])
+        n_rows = meta['n_rows']
+        store = cls(directory, schema, n_rows, meta)
+        if n_rows == 0:
+            return store, schema.empty(0), np.zeros(0, dtype=bool)
+        
+        X = np.memmap(os.path.join(directory, cls.FEATURES_FILE), dtype=schema.matrix_dtype,
+                      mode='r', shape=(n_rows, len(schema)))
+        y = np.memmap(os.path.join(directory, cls.LABELS_FILE), dtype=np.bool_,
+                      mode='r', shape=(n_rows,))
+        return store, X, y
+
 class AdvancedAdDetector:
     """Machine Learning based YouTube Ad Detection System"""
     
-    def __init__(self):
+    def __init__(self, cache_size=4096, cache_ttl=300.0, rules_path=DEFAULT_RULES_PATH, cascade=False):
         self.model = None
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
+        self.forest = None
+        # Fitted with every model; only consulted when cascade mode is on
+        self.cascade = None
+        self.use_cascade = cascade
+        self.text_features = TextHasher()
+        # Cleared by model_changed when the forest never splits on a text column
+        self.use_text_features = True
         self.is_trained = False
-        self.features = [
-            'has_ad_keywords', 'has_sponsored_text', 'is_promoted',
-            'has_ad_badge', 'video_duration_short', 'description_length',
-            'title_contains_ad', 'channel_verified', 'view_count_low',
-            'like_ratio_low', 'comment_count_low', 'upload_frequency_high'
-        ]
+        self.model_version = 0
+        self.schema = FeatureSchema()
+        self.keyword_matcher = KEYWORD_MATCHER
+        self.url_matcher = URL_PATTERN_MATCHER
+        self.url_rules = load_rule_engine(rules_path) if rules_path else None
+        # A feedback.FeedbackLearner attaches itself here to correct predictions
+        self.feedback = None
+        self.cache = PredictionCache(cache_size, cache_ttl) if cache_size else None
+    
+    @property
+    def features(self):
+        """Feature names in model column order"""
+        return self.schema.names
         
     def extract_features(self, element_data):
         """Extract features from YouTube element data"""
-        features = {}
+        row = self.schema.empty(1)[0]
+        self.extract_features_into(element_data, row)
+        return self.schema.row_to_dict(row)
+    
+    def extract_features_into(self, element_data, row, matches=None, text=True):
+        """Write the features of one element directly into a preallocated schema row
+        
+        If a matches dict is given it receives the matched terms per field, so
+        reasoning can reuse them without rescanning the text. Batch callers pass
+        text=False and hash the whole batch with extract_text_features.
+        """
+        col = self.schema.index
         
         # Text-based features
-        title = element_data.get('title', '').lower()
-        description = element_data.get('description', '').lower()
+        title = element_data.get('title', '')
+        description = element_data.get('description', '')
         
-        # Ad keyword detection
-        ad_keywords = ['ad', 'advertisement', 'sponsored', 'promotion', 'paid', 'commercial']
-        features['has_ad_keywords'] = any(keyword in title for keyword in ad_keywords)
-        features['has_sponsored_text'] = any(keyword in description for keyword in ad_keywords)
-        features['title_contains_ad'] = features['has_ad_keywords'] or features['has_sponsored_text']
+        # Ad keyword detection, one scan per field with word-boundary semantics
+        title_terms = self.keyword_matcher.find(title)
+        description_terms = self.keyword_matcher.find(description)
+        row[col['has_ad_keywords']] = bool(title_terms)
+        row[col['has_sponsored_text']] = bool(description_terms)
+        row[col['title_contains_ad']] = bool(title_terms or description_terms)
         
         # Visual indicators
-        features['has_ad_badge'] = element_data.get('has_ad_badge', False)
-        features['is_promoted'] = element_data.get('is_promoted', False)
+        row[col['has_ad_badge']] = bool(element_data.get('has_ad_badge', False))
+        row[col['is_promoted']] = bool(element_data.get('is_promoted', False))
         
         # Video metadata features
         duration = element_data.get('duration', 0)
-        features['video_duration_short'] = duration < 30 and duration > 0
-        
-        features['description_length'] = len(description)
-        features['description_too_short'] = len(description) < 50
+        row[col['video_duration_short']] = duration < 30 and duration > 0
+        row[col['description_length']] = len(description)
         
         # Channel features
-        features['channel_verified'] = element_data.get('channel_verified', False)
-        features['subscriber_count_low'] = element_data.get('subscriber_count', 0) < 1000
+        row[col['channel_verified']] = bool(element_data.get('channel_verified', False))
         
         # Engagement metrics
         view_count = element_data.get('view_count', 0)
         like_count = element_data.get('like_count', 0)
         comment_count = element_data.get('comment_count', 0)
         
-        features['view_count_low'] = view_count < 10000
-        features['like_ratio_low'] = (like_count / max(view_count, 1)) < 0.01
-        features['comment_count_low'] = comment_count < 100
+        row[col['view_count_low']] = view_count < 10000
+        row[col['like_ratio_low']] = (like_count / max(view_count, 1)) < 0.01
+        row[col['comment_count_low']] = comment_count < 100
         
         # Upload frequency
         upload_freq = element_data.get('upload_frequency', 0)
-        features['upload_frequency_high'] = upload_freq > 10  # uploads per day
+        row[col['upload_frequency_high']] = upload_freq > 10  # uploads per day
         
         # URL patterns
-        url = element_data.get('url', '').lower()
-        ad_patterns = ['doubleclick', 'googleads', 'youtube.com/ads', 'advertising']
-        features['url_has_ad_patterns'] = any(pattern in url for pattern in ad_patterns)
+        url = element_data.get('url', '')
+        url_terms = self.url_matcher.find(url)
+        if self.url_rules is not None and url and isinstance(url, str):
+            rule = self.url_rules.match(url)
+            if rule is not None and rule['action'] == 'block':
+                url_terms = url_terms | {rule['url_filter'] or f"rule {rule['rule_id']}"}
+        row[col['url_has_ad_patterns']] = bool(url_terms)
+        
+        if matches is not None:
+            matches['title'] = title_terms
+            matches['description'] = description_terms
+            matches['url'] = url_terms
+        
+        if text:
+            self.extract_text_features([element_data], row[None, :])
+        
+        return row
+    
+    def extract_text_features(self, elements, matrix, skip_unused=True):
+        """Fill the text columns of a batch's feature matrix in one hashing pass
         
-        return features
+        With skip_unused, nothing is computed for a model that never splits on
+        a text column; those columns are then left at zero.
+        """
+        columns = self.schema.text_columns
+        if columns and not (skip_unused and not self.use_text_features):
+            matrix[:, columns] = self.text_features.transform(elements)
     
-    def prepare_training_data(self, dataset_path=None):
+    def extract_feature_matrix(self, elements, matches=None):
+        """Extract a whole batch into one matrix; returns (matrix, valid_mask, errors)
+        
+        Pass a list as matches to collect the per-element matched terms.
+        """
+        matrix = self.schema.empty(len(elements))
+        valid = np.ones(len(elements), dtype=bool)
+        errors = {}
+        
+        for i, element_data in enumerate(elements):
+            element_matches = {} if matches is not None else None
+            if matches is not None:
+                matches.append(element_matches)
+            try:
+                self.extract_features_into(element_data, matrix[i], element_matches, text=False)
+            except Exception as e:
+                valid[i] = False
+                errors[i] = str(e)
+        
+        self.extract_text_features(elements, matrix)
+        return matrix, valid, errors
+    
+    def prepare_training_data(self, dataset_path=None, n_samples=1000, seed=42):
         """Prepare training dataset"""
         if dataset_path is None:
             # Generate synthetic training data based on known patterns
-            return self.generate_synthetic_data()
+            return self.generate_synthetic_data(n_samples, seed)
         
         try:
+            import pandas as pd
             df = pd.read_csv(dataset_path)
             return df
         except Exception as e:
+            # Never train on made-up data when a real dataset was asked for
             logger.error(f"Error loading dataset: {e}")
-            return self.generate_synthetic_data()
-    
-    def generate_synthetic_data(self):
-        """Generate synthetic training data for demonstration"""
-        np.random.seed(42)
-        n_samples = 1000
-        
-        data = []
-        for i in range(n_samples):
-            # Generate random features
-            sample = {
-                'has_ad_keywords': np.random.choice([True, False], p=[0.3, 0.7]),
-                'has_sponsored_text': np.random.choice([True, False], p=[0.2, 0.8]),
-                'title_contains_ad': np.random.choice([True, False], p=[0.25, 0.75]),
-                'has_ad_badge': np.random.choice([True, False], p=[0.15, 0.85]),
-                'is_promoted': np.random.choice([True, False], p=[0.2, 0.8]),
-                'video_duration_short': np.random.choice([True, False], p=[0.4, 0.6]),
-                'description_length': np.random.randint(10, 500),
-                'channel_verified': np.random.choice([True, False], p=[0.3, 0.7]),
-                'view_count_low': np.random.choice([True, False], p=[0.3, 0.7]),
-                'like_ratio_low': np.random.choice([True, False], p=[0.35, 0.65]),
-                'comment_count_low': np.random.choice([True, False], p=[0.4, 0.6]),
-                'upload_frequency_high': np.random.choice([True, False], p=[0.25, 0.75]),
-                'url_has_ad_patterns': np.random.choice([True, False], p=[0.1, 0.9])
-            }
-            
-            # Label as ad based on multiple indicators
-            ad_indicators = [
-                sample['has_ad_keywords'], sample['has_sponsored_text'],
-                sample['has_ad_badge'], sample['is_promoted'],
-                sample['url_has_ad_patterns']
-            ]
+            raise
+    
+    def iter_training_log(self, log_path, report, label_field='is_ad'):
+        """Yield (line_number, element_data, label) from a CSV or JSONL element log"""
+        is_jsonl = log_path.endswith(('.jsonl', '.ndjson', '.json'))
+        precomputed = self.log_has_feature_columns(log_path)
+        
+        with open(log_path, newline='' if not is_jsonl else None, encoding='utf-8') as f:
+            rows = enumerate(f, start=1) if is_jsonl else enumerate(csv.DictReader(f), start=2)
             
-            # Higher probability of being an ad if multiple indicators are present
-            ad_probability = sum(ad_indicators) / len(ad_indicators)
-            sample['is_ad'] = ad_probability > 0.4 or (sample['video_duration_short'] and sample['view_count_low'])
+            for line_number, row in rows:
+                if is_jsonl and not row.strip():
+                    continue
+                
+                report.rows_read += 1
+                try:
+                    if is_jsonl:
+                        element_data = json.loads(row)
+                        if not isinstance(element_data, dict):
+                            raise ValueError('Line is not a JSON object')
+                    elif precomputed:
+                        element_data = dict(row)
+                    else:
+                        element_data = self.coerce_csv_element(row)
+                    
+                    label = parse_flag(element_data.pop(label_field))
+                except KeyError:
+                    report.skip(line_number, f"Missing label field '{label_field}'")
+                    continue
+                except ValueError as e:
+                    report.skip(line_number, str(e))
+                    continue
+                
+                yield line_number, element_data, label
+    
+    def log_has_feature_columns(self, log_path):
+        """True for CSV logs whose header already contains every schema column but the text ones"""
+        if log_path.endswith(('.jsonl', '.ndjson', '.json')):
+            return False
+        with open(log_path, newline='', encoding='utf-8') as f:
+            header = next(csv.reader(f), [])
+        return set(self.schema.names) - TEXT_FEATURE_NAMES <= set(header)
+    
+    def feature_row_from_values(self, values, row):
+        """Fill a schema row from already computed feature values; missing text columns are zero"""
+        for i, (name, dtype) in enumerate(self.schema.columns):
+            value = values.get(name, 0) if name in TEXT_FEATURE_NAMES else values[name]
+            row[i] = parse_flag(value) if dtype == 'bool' else float(value)
+        return row
+    
+    def coerce_csv_element(self, row):
+        """Turn CSV text fields into the types extract_features expects"""
+        element_data = {key: value for key, value in row.items() if key is not None}
+        
+        for field in NUMERIC_ELEMENT_FIELDS:
+            value = element_data.get(field)
+            if value is not None:
+                element_data[field] = float(value) if value.strip() else 0
+        for field in BOOLEAN_ELEMENT_FIELDS:
+            if field in element_data:
+                element_data[field] = parse_flag(element_data[field])
+        
+        return element_data
+    
+    def ingest_training_log(self, log_path, store_dir, chunk_size=10000, label_field='is_ad'):
+        """Stream a labelled element log through feature extraction into a FeatureStore"""
+        report = IngestReport(log_path)
+        store = FeatureStore.create(store_dir, self.schema, source=os.path.abspath(log_path))
+        
+        # CSVs that already hold the schema columns (e.g. exported synthetic data)
+        # are copied as feature rows instead of being re-extracted
+        precomputed = self.log_has_feature_columns(log_path)
+        
+        chunk = self.schema.empty(chunk_size)
+        labels = np.zeros(chunk_size, dtype=bool)
+        line_numbers = [0] * chunk_size
+        filled = 0
+        
+        def flush(count):
+            valid = np.ones(count, dtype=bool)
+            for i in range(count):
+                try:
+                    chunk[i] = 0
+                    if precomputed:
+                        self.feature_row_from_values(elements[i], chunk[i])
+                    else:
+                        self.extract_features_into(elements[i], chunk[i], text=False)
+                except Exception as e:
+                    valid[i] = False
+                    report.skip(line_numbers[i], f"Feature extraction failed: {e}")
+            if not precomputed:
+                # Training data always gets its text features, whatever the loaded model uses
+                self.extract_text_features(elements[:count], chunk[:count], skip_unused=False)
+            store.append(chunk[:count][valid], labels[:count][valid])
+            report.rows_ingested += int(valid.sum())
+        
+        try:
+            elements = [None] * chunk_size
+            for line_number, element_data, label in self.iter_training_log(log_path, report, label_field):
+                elements[filled] = element_data
+                labels[filled] = label
+                line_numbers[filled] = line_number
+                filled += 1
+                
+                if filled == chunk_size:
+                    flush(filled)
+                    filled = 0
+                    logger.info(f"Ingested {report.rows_ingested} rows from {log_path}")
             
-            data.append(sample)
+            if filled:
+                flush(filled)
+        finally:
+            store.close(report)
+        
+        if report.rows_skipped:
+            logger.warning(f"Skipped {report.rows_skipped} of {report.rows_read} rows in {log_path}; "
+                           f"first errors: {report.errors[:3]}")
+        if report.rows_ingested == 0:
+            raise ValueError(f"No usable training rows in {log_path}")
+        
+        logger.info(f"Ingested {report.rows_ingested} rows from {log_path} into {store_dir}")
+        return report
+    
+    def load_training_matrix(self, dataset_path, max_rows=DEFAULT_MAX_TRAINING_ROWS, seed=42):
+        """Return (X, y) for a feature store directory or a raw CSV/JSONL element log"""
+        if os.path.isdir(dataset_path):
+            store_dir = dataset_path
+        else:
+            store_dir = dataset_path + '.features'
+            meta_path = os.path.join(store_dir, FeatureStore.META_FILE)
+            if not (FeatureStore.exists(store_dir)
+                    and os.path.getmtime(meta_path) >= os.path.getmtime(dataset_path)
+                    and FeatureStore.open(store_dir)[0].schema.names == self.schema.names):
+                self.ingest_training_log(dataset_path, store_dir)
+        
+        store, X, y = FeatureStore.open(store_dir)
+        if store.schema.names != self.schema.names:
+            raise ValueError(f"Feature store {store_dir} was built with a different schema")
+        
+        if max_rows is not None and store.n_rows > max_rows:
+            rows = np.sort(np.random.default_rng(seed).choice(store.n_rows, max_rows, replace=False))
+            logger.info(f"Sampling {max_rows} of {store.n_rows} stored rows for training")
+            return X[rows], y[rows]
+        
+        return np.asarray(X), np.asarray(y)
+    
+    def generate_synthetic_data(self, n_samples=1000, seed=42):
+        """Generate synthetic training data for demonstration
+        
+        Every column is drawn as a whole array from a local generator, so this
+        scales to millions of rows without touching the global numpy seed.
+        """
+        rng = np.random.default_rng(seed)
+        
+        # Generate random features; synthetic rows have no text to hash, so
+        # the text columns are left out rather than filled with zeros
+        data = {}
+        for name, dtype in self.schema.columns:
+            if name in TEXT_FEATURE_NAMES:
+                continue
+            if name == 'description_length':
+                data[name] = rng.integers(10, 500, size=n_samples)
+            else:
+                data[name] = rng.random(n_samples) < SYNTHETIC_FEATURE_RATES[name]
+        
+        # Label as ad based on multiple indicators
+        ad_indicators = (
+            data['has_ad_keywords'].astype(np.int8) + data['has_sponsored_text']
+            + data['has_ad_badge'] + data['is_promoted'] + data['url_has_ad_patterns']
+        )
         
+        # Higher probability of being an ad if multiple indicators are present
+        data['is_ad'] = (ad_indicators / 5 > 0.4) | (data['video_duration_short'] & data['view_count_low'])
+        
+        import pandas as pd
         return pd.DataFrame(data)
     
-    def train_model(self, dataset_path=None):
+    def search_hyperparameters(self, X, y, param_grid=None, cv=3, n_jobs=-1, eta=3,
+                               min_rows=300, cost_weight=0.01, seed=42, progress=None):
+        """Successive-halving search for forest settings across a process pool"""
+        param_grid = param_grid or SEARCH_GRID
+        names = list(param_grid)
+        candidates = [dict(DEFAULT_FOREST_PARAMS, **dict(zip(names, values)))
+                      for values in itertools.product(*(param_grid[name] for name in names))]
+        reference_cost = DEFAULT_FOREST_PARAMS['n_estimators'] * DEFAULT_FOREST_PARAMS['max_depth']
+        report = progress or (lambda fraction: None)
+        
+        # Shuffle once so every round's slice is a random sample and a prefix of the next
+        order = np.random.default_rng(seed).permutation(len(X))
+        X, y = X[order], y[order]
+        
+        rounds = max(1, int(math.log(len(candidates), eta)))
+        workers = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+        workers = max(1, min(workers, len(candidates)))
+        logger.info(f"Searching {len(candidates)} forest settings in {rounds} rounds on {workers} processes")
+        
+        # spawn, not fork: training may run inside a multi-threaded process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_search_worker, initargs=(X, y)) as pool:
+            for round_index in range(rounds):
+                n_rows = min(len(X), max(min_rows, len(X) // eta ** (rounds - 1 - round_index)))
+                outcomes = list(pool.map(_evaluate_candidate, candidates, itertools.repeat(n_rows),
+                                         itertools.repeat(cv), itertools.repeat(seed)))
+                
+                results = sorted((
+                    {
+                        'params': params,
+                        'accuracy': accuracy,
+                        'inference_cost': cost,
+                        'score': accuracy - cost_weight * cost / reference_cost
+                    }
+                    for params, (accuracy, cost) in zip(candidates, outcomes)
+                ), key=lambda result: (-round(result['score'], 6), result['inference_cost']))
+                
+                logger.info(f"Search round {round_index + 1}/{rounds}: {len(candidates)} candidates on {n_rows} rows, "
+                            f"best score {results[0]['score']:.4f}")
+                report((round_index + 1) / rounds)
+                
+                candidates = [result['params'] for result in results[:max(1, len(results) // eta)]]
+        
+        for result in results[:5]:
+            logger.info(f"Search result {result['params']}: accuracy {result['accuracy']:.4f}, "
+                        f"cost {result['inference_cost']:.0f}, score {result['score']:.4f}")
+        
+        return results[0]['params'], results
+    
+    def train_model(self, dataset_path=None, model_path='ad_detector_model.pkl', progress=None,
+                    max_rows=DEFAULT_MAX_TRAINING_ROWS, search=False, n_jobs=None):
         """Train the ML model"""
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.metrics import accuracy_score
+        from sklearn.model_selection import train_test_split
+        
         logger.info("Starting model training...")
+        report = progress or (lambda stage, fraction: None)
         
         # Prepare training data
-        df = self.prepare_training_data(dataset_path)
+        report('preparing_data', 0.0)
+        feature_columns = self.schema.names
+        if dataset_path is None:
+            df = self.prepare_training_data()
+            
+            # Synthetic data only has the core columns
+            self.schema = FeatureSchema([column for column in self.schema.columns if column[0] in df.columns])
+            feature_columns = self.schema.names
+            
+            # Separate features and target, in schema column order
+            X = df[feature_columns].to_numpy(dtype=self.schema.matrix_dtype)
+            y = df['is_ad'].to_numpy(dtype=bool)
+        else:
+            X, y = self.load_training_matrix(dataset_path, max_rows=max_rows)
         
-        # Separate features and target
-        feature_columns = [col for col in df.columns if col != 'is_ad']
-        X = df[feature_columns]
-        y = df['is_ad']
+        # Training data without any text (synthetic rows, feature-only CSVs)
+        # leaves the text columns constant; drop them rather than let them
+        # change how many features the forest samples per split
+        if self.schema.text_columns and not X[:, self.schema.text_columns].any():
+            keep = [i for i, name in enumerate(feature_columns) if name not in TEXT_FEATURE_NAMES]
+            self.schema = FeatureSchema([self.schema.columns[i] for i in keep])
+            feature_columns = self.schema.names
+            X = X[:, keep]
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
+        forest_params = DEFAULT_FOREST_PARAMS
+        if search:
+            report('searching', 0.1)
+            forest_params, _ = self.search_hyperparameters(
+                X_train, y_train, n_jobs=-1 if n_jobs is None else n_jobs,
+                progress=lambda fraction: report('searching', 0.1 + 0.5 * fraction)
+            )
+            logger.info(f"Selected forest settings: {forest_params}")
+        
         # Train Random Forest model
-        self.model = RandomForestClassifier(
-            n_estimators=100,
-            random_state=42,
-            max_depth=10,
-            min_samples_split=5,
-            min_samples_leaf=2
-        )
+        self.model = RandomForestClassifier(random_state=42, n_jobs=n_jobs, **forest_params)
         
+        report('fitting', 0.6 if search else 0.2)
         self.model.fit(X_train, y_train)
+        # Parallelism is a training concern; the pickled model scores on one thread
+        self.model.n_jobs = None
         
         # Evaluate model
+        report('evaluating', 0.8)
         y_pred = self.model.predict(X_test)
         accuracy = accuracy_score(y_test, y_pred)
         
@@ -173,10 +857,22 @@ class AdvancedAdDetector:
         for i, importance in enumerate(feature_importance):
             logger.info(f"Feature {feature_columns[i]}: {importance:.4f}")
         
+        # Stage-one table for cascade mode, tuned on the held-out split
+        self.cascade = RuleCascade.fit(
+            self.schema, X_train, y_train, X_test, y_test,
+            self.model.predict_proba(X_test)[:, 1], feature_importance
+        )
+        validation = self.cascade.validation
+        logger.info(f"Cascade fast path takes {validation['fast_path_share']:.1%} of held-out elements "
+                    f"at accuracy {validation['accuracy']:.3f} (forest {validation['forest_accuracy']:.3f})")
+        
         self.is_trained = True
+        self.model_changed()
         
         # Save model
-        self.save_model()
+        report('saving', 0.9)
+        self.save_model(model_path)
+        report('complete', 1.0)
         
         return accuracy
     
@@ -187,36 +883,191 @@ class AdvancedAdDetector:
             return 0.5
         
         try:
-            features = self.extract_features(element_data)
-            feature_vector = [features.get(feature, False) for feature in self.features]
-            
-            # Reshape for single prediction
-            feature_vector = np.array(feature_vector).reshape(1, -1)
+            feature_vector = self.schema.empty(1)
+            self.extract_features_into(element_data, feature_vector[0])
             
             # Get probability prediction
-            probability = self.model.predict_proba(feature_vector)[0][1]
-            return probability
+            probability = self.score_matrix(feature_vector)
+            if self.feedback is not None:
+                probability = self.feedback.correct(probability, feature_vector,
+                                                    [PredictionCache.key_for(element_data)])
+            return probability[0]
             
         except Exception as e:
             logger.error(f"Error in prediction: {e}")
             return 0.5
     
+    def predict_batch(self, elements, threshold=0.7, timings=None, keys=None):
+        """Score many elements with a single forest evaluation"""
+        results = []
+        misses = []
+        miss_keys = []
+        
+        for i, element_data in enumerate(elements):
+            is_dict = isinstance(element_data, dict)
+            results.append({'element_id': element_data.get('id') if is_dict else None})
+            
+            key = None
+            if self.cache is not None and is_dict:
+                key = keys[i] if keys is not None else self.cache.key_for(element_data)
+            cached = self.cache.get(key, self.model_version) if key is not None else None
+            if cached is not None:
+                probability, reasoning = cached
+                results[i].update({
+                    'is_ad': bool(probability >= threshold),
+                    'confidence': probability,
+                    'reasoning': list(reasoning)
+                })
+            else:
+                misses.append(i)
+                miss_keys.append(key)
+        
+        if not misses:
+            return results
+        
+        # Extract the misses into one matrix; bad elements get an error entry
+        matches = []
+        miss_elements = [elements[i] for i in misses]
+        started = time.perf_counter()
+        feature_matrix, valid, errors = self.extract_feature_matrix(miss_elements, matches)
+        extracted = time.perf_counter()
+        rows = np.flatnonzero(valid)
+        probabilities = np.full(len(rows), 0.5)
+        
+        # Fallback scores (untrained model, failed prediction) are never cached
+        cacheable = False
+        if len(rows) and self.is_trained:
+            try:
+                probabilities = self.score_matrix(feature_matrix[rows])
+                if self.feedback is not None:
+                    keys = None
+                    if self.feedback.overrides:
+                        keys = [miss_keys[j] if miss_keys[j] is not None
+                                else PredictionCache.key_for(miss_elements[j]) for j in rows]
+                    probabilities = self.feedback.correct(probabilities, feature_matrix[rows], keys)
+                cacheable = self.cache is not None
+            except Exception as e:
+                logger.error(f"Error in batch prediction: {e}")
+        elif len(rows):
+            logger.warning("Model not trained. Call train_model() first.")
+        predicted = time.perf_counter()
+        
+        for j, error in errors.items():
+            results[misses[j]]['error'] = error
+        
+        for j, probability in zip(rows, probabilities):
+            probability = float(probability)
+            reasoning = self.reasoning_from_row(feature_matrix[j], matches[j])
+            results[misses[j]].update({
+                'is_ad': bool(probability >= threshold),
+                'confidence': probability,
+                'reasoning': reasoning
+            })
+            if cacheable and miss_keys[j] is not None:
+                self.cache.put(miss_keys[j], self.model_version, (probability, tuple(reasoning)))
+        
+        if timings is not None:
+            for stage, seconds in (('extract_features', extracted - started),
+                                   ('predict_proba', predicted - extracted),
+                                   ('get_reasoning', time.perf_counter() - predicted)):
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        
+        return results
+    
+    def score_matrix(self, matrix):
+        """Ad probability for each row of a feature matrix
+        
+        In cascade mode rows the stage-one table is sure about are answered from
+        it and only the rest are evaluated by the forest.
+        """
+        if not self.use_cascade or self.cascade is None:
+            return self.forest.predict_proba(matrix)[:, 1]
+        
+        probabilities, fast = self.cascade.split(matrix)
+        escalated = np.flatnonzero(~fast)
+        if len(escalated):
+            probabilities[escalated] = self.forest.predict_proba(matrix[escalated])[:, 1]
+        return probabilities
+    
+    def model_changed(self):
+        """Recompile the inference engine and drop predictions cached for older models"""
+        self.forest = PackedForest.from_model(self.model)
+        self.use_text_features = bool(np.isin(self.forest.feature, self.schema.text_columns).any())
+        self.predictions_changed()
+    
+    def predictions_changed(self):
+        """Invalidate cached predictions after the model or its feedback correction changed"""
+        self.model_version = next(_model_versions)
+        if self.cache is not None:
+            self.cache.clear()
+    
     def is_ad(self, element_data, threshold=0.7):
         """Classify if element is an ad"""
         probability = self.predict_ad_probability(element_data)
         return probability >= threshold
     
-    def save_model(self, model_path='ad_detector_model.pkl'):
-        """Save trained model"""
+    def save_model(self, model_path='ad_detector_model.pkl', packed=True):
+        """Save trained model together with its feature schema"""
         if self.model:
-            joblib.dump(self.model, model_path)
+            if not model_path.endswith(PACKED_EXTENSION):
+                self.schema.save(FeatureSchema.path_for(model_path))
+                cascade_path = RuleCascade.path_for(model_path)
+                if self.cascade is not None:
+                    atomic_write(cascade_path, lambda f: json.dump(self.cascade.to_dict(), f), mode='w')
+                elif os.path.exists(cascade_path):
+                    os.remove(cascade_path)
+                import joblib
+                atomic_write(model_path, lambda f: joblib.dump(self.model, f))
+            
+            if packed or model_path.endswith(PACKED_EXTENSION):
+                # Written last, so a fresh artifact is never older than its joblib model
+                self.forest.metadata['schema'] = self.schema.to_dict()
+                self.forest.metadata['cascade'] = self.cascade.to_dict() if self.cascade is not None else None
+                atomic_write(PackedForest.path_for(model_path), self.forest.write)
+            
             logger.info(f"Model saved to {model_path}")
     
-    def load_model(self, model_path='ad_detector_model.pkl'):
+    def load_model(self, model_path='ad_detector_model.pkl', prefer_packed=True):
         """Load pre-trained model"""
         try:
-            self.model = joblib.load(model_path)
+            packed_path = PackedForest.path_for(model_path)
+            use_packed = packed_path == model_path or (
+                prefer_packed and os.path.exists(packed_path) and (
+                    not os.path.exists(model_path)
+                    or os.path.getmtime(packed_path) >= os.path.getmtime(model_path)
+                )
+            )
+            
+            if use_packed:
+                model = PackedForest.load(packed_path)
+                schema = FeatureSchema.from_dict(model.metadata['schema'])
+                cascade = model.metadata.get('cascade')
+                model_path = packed_path
+            else:
+                import joblib
+                model = joblib.load(model_path)
+                
+                # Models saved before the schema file existed use the default layout
+                schema_path = FeatureSchema.path_for(model_path)
+                schema = FeatureSchema.load(schema_path) if os.path.exists(schema_path) else FeatureSchema()
+                
+                cascade_path = RuleCascade.path_for(model_path)
+                cascade = None
+                if os.path.exists(cascade_path):
+                    with open(cascade_path) as f:
+                        cascade = json.load(f)
+            
+            if getattr(model, 'n_features_in_', len(schema)) != len(schema):
+                raise ValueError(
+                    f"Model expects {model.n_features_in_} features but schema defines {len(schema)}"
+                )
+            
+            self.model = model
+            self.schema = schema
+            # Models saved before cascades existed simply always use the forest
+            self.cascade = RuleCascade.from_dict(cascade, schema) if cascade else None
             self.is_trained = True
+            self.model_changed()
             logger.info(f"Model loaded from {model_path}")
             return True
         except FileNotFoundError:
@@ -228,45 +1079,51 @@ class AdvancedAdDetector:
     
     def analyze_youtube_page(self, page_data):
         """Analyze entire YouTube page for ads"""
-        results = []
+        elements = page_data.get('elements', [])
+        results = self.predict_batch(elements, threshold=0.7)
         
-        for element in page_data.get('elements', []):
-            probability = self.predict_ad_probability(element)
-            is_ad = self.is_ad(element, threshold=0.7)
-            
-            results.append({
-                'element_id': element.get('id'),
-                'title': element.get('title', ''),
-                'is_ad': is_ad,
-                'confidence': probability,
-                'reasoning': self.get_reasoning(element, probability)
-            })
+        for element, result in zip(elements, results):
+            if isinstance(element, dict):
+                result['title'] = element.get('title', '')
         
         return {
             'total_elements': len(results),
-            'ads_detected': sum(1 for r in results if r['is_ad']),
+            'ads_detected': sum(1 for r in results if r.get('is_ad', False)),
             'analysis_time': datetime.now().isoformat(),
             'results': results
         }
     
     def get_reasoning(self, element_data, probability):
         """Get human-readable reasoning for classification"""
+        row = self.schema.empty(1)[0]
+        matches = {}
+        self.extract_features_into(element_data, row, matches)
+        return self.reasoning_from_row(row, matches)
+    
+    def reasoning_from_row(self, row, matches=None):
+        """Build reasoning from an already extracted feature row and its matched terms"""
         reasons = []
+        col = self.schema.index
+        matches = matches or {}
         
-        features = self.extract_features(element_data)
+        def with_terms(reason, field):
+            terms = matches.get(field)
+            return f"{reason} ({', '.join(sorted(terms))})" if terms else reason
         
-        if features['has_ad_keywords']:
-            reasons.append("Contains ad keywords")
-        if features['has_sponsored_text']:
-            reasons.append("Sponsored content detected")
-        if features['has_ad_badge']:
+        if row[col['has_ad_keywords']]:
+            reasons.append(with_terms("Contains ad keywords", 'title'))
+        if row[col['has_sponsored_text']]:
+            reasons.append(with_terms("Sponsored content detected", 'description'))
+        if row[col['has_ad_badge']]:
             reasons.append("Ad badge present")
-        if features['is_promoted']:
+        if row[col['is_promoted']]:
             reasons.append("Promoted content")
-        if features['video_duration_short'] and features['view_count_low']:
+        if row[col['video_duration_short']] and row[col['view_count_low']]:
             reasons.append("Short video with low views")
-        if features['like_ratio_low'] and features['comment_count_low']:
+        if row[col['like_ratio_low']] and row[col['comment_count_low']]:
             reasons.append("Low engagement metrics")
+        if row[col['url_has_ad_patterns']]:
+            reasons.append(with_terms("Ad URL pattern", 'url'))
         
         return reasons if reasons else ["No strong ad indicators"]
 
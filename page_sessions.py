@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Page Sessions for YouTube Ad Blocker Pro
+Per-page state for incremental page analysis, so the content script's
+repeated scans only score elements that are new or have changed
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ml_detector import PredictionCache
+
+class PageSession:
+    """What the service last told one page: element id -> (content hash, result)"""
+    
+    __slots__ = ('elements', 'model_version', 'last_used')
+    
+    def __init__(self, model_version):
+        self.elements = OrderedDict()
+        self.model_version = model_version
+        self.last_used = time.monotonic()
+
+class PageSessionStore:
+    """Bounded LRU store of page sessions with an idle TTL"""
+    
+    def __init__(self, max_sessions=1024, max_elements=5000, ttl=600.0):
+        self.max_sessions = max_sessions
+        self.max_elements = max_elements
+        self.ttl = ttl
+        self.scored = 0
+        self.skipped = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def analyze(self, detector, session_id, elements, full=False, removed=(), threshold=0.7, timings=None):
+        """Score the new and changed elements of a page and update its session
+        
+        Without a session_id a new session is started and its id returned.
+        """
+        new_session = session_id is None
+        if new_session:
+            session_id = uuid.uuid4().hex
+        
+        started = time.perf_counter()
+        keyed = OrderedDict()
+        for element in elements:
+            key = PredictionCache.key_for(element)
+            element_id = element.get('id')
+            keyed[key.hex() if element_id is None else str(element_id)] = (key, element)
+        if timings is not None:
+            timings['page_diff'] = timings.get('page_diff', 0.0) + time.perf_counter() - started
+        
+        with self._lock:
+            session, started_over = self._checkout(session_id, detector.model_version)
+            known = session.elements
+            # A full list is rescored in full anyway
+            resync = started_over and not (full or new_session)
+            
+            if full:
+                removed_ids = [element_id for element_id in known if element_id not in keyed]
+            else:
+                removed_ids = [str(element_id) for element_id in removed if str(element_id) in known]
+            for element_id in removed_ids:
+                del known[element_id]
+            
+            pending = [(element_id, key, element) for element_id, (key, element) in keyed.items()
+                       if element_id not in known or known[element_id][0] != key]
+        
+        # Scoring runs unlocked; sessions are keyed per page, so concurrent
+        # requests for the same one are unusual and the last writer wins
+        results = detector.predict_batch([element for _, _, element in pending], threshold=threshold,
+                                         timings=timings, keys=[key for _, key, _ in pending])
+        
+        new_results = []
+        with self._lock:
+            for (element_id, key, element), result in zip(pending, results):
+                if result.get('element_id') is None:
+                    result['element_id'] = element_id
+                result['title'] = element.get('title', '')
+                if 'error' not in result:
+                    known[element_id] = (key, result)
+                    known.move_to_end(element_id)
+                new_results.append(result)
+            
+            while len(known) > self.max_elements:
+                known.popitem(last=False)
+            self.scored += len(pending)
+            self.skipped += len(keyed) - len(pending)
+            ads_on_page = sum(1 for _, result in known.values() if result.get('is_ad', False))
+            tracked = len(known)
+        
+        return {
+            'session_id': session_id,
+            'resync': resync,
+            'total_elements': tracked,
+            'ads_detected': ads_on_page,
+            'unchanged': len(keyed) - len(pending),
+            'removed': removed_ids,
+            'results': new_results
+        }
+    
+    def _checkout(self, session_id, model_version):
+        """(session, started over) for session_id, creating or resetting it as needed; lock held"""
+        now = time.monotonic()
+        # Least recently used first, so expired sessions are all at the front
+        while self._sessions and now - next(iter(self._sessions.values())).last_used > self.ttl:
+            self._sessions.popitem(last=False)
+        
+        session = self._sessions.get(session_id)
+        started_over = session is None or session.model_version != model_version
+        if started_over:
+            session = self._sessions[session_id] = PageSession(model_version)
+        session.last_used = now
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session, started_over
+    
+    def discard(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+    
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+        total = self.scored + self.skipped
+        return {
+            'sessions': sessions,
+            'max_sessions': self.max_sessions,
+            'ttl_seconds': self.ttl,
+            'scored': self.scored,
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / total if total else 0.0
+        }
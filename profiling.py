@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Profiling for YouTube Ad Blocker Pro
+On-demand stack sampling and a slow-request log, for finding hot paths in a
+running ML service without restarting it
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Innermost frames of threads that are blocked rather than working: pool
+# workers waiting for a job, selector loops, idle keep-alive reads
+IDLE_FRAMES = frozenset({
+    'threading.py:wait', 'threading.py:_wait_for_tstate_lock', 'thread.py:_worker', 'selectors.py:select',
+    'socket.py:readinto', 'socket.py:accept'
+})
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running"""
+
+_profile_lock = threading.Lock()
+
+def _frame_label(code, labels):
+    label = labels.get(code)
+    if label is None:
+        label = labels[code] = f'{os.path.basename(code.co_filename)}:{code.co_name}'
+    return label
+
+def sample_stacks(seconds, interval=0.005, include_idle=False):
+    """Sample every other thread's Python stack for `seconds`"""
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy('A profile is already running')
+    
+    try:
+        me = threading.get_ident()
+        labels = {}
+        stacks = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        
+        while time.perf_counter() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if not include_idle and _frame_label(frame.f_code, labels) in IDLE_FRAMES:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame.f_code, labels))
+                    frame = frame.f_back
+                stacks[';'.join(reversed(frames))] += 1
+            samples += 1
+            time.sleep(interval)
+        
+        return stacks, samples
+    finally:
+        _profile_lock.release()
+
+def collapsed_text(stacks):
+    """Stacks in the collapsed format flamegraph.pl and speedscope read, busiest first"""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+class SlowRequestLog:
+    """Ring buffer of the most recent requests that took longer than threshold_ms"""
+    
+    def __init__(self, threshold_ms=250.0, max_entries=200):
+        self.threshold_ms = threshold_ms
+        self.recorded = 0
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+    
+    def record(self, method, endpoint, status, seconds, timings, shape=None):
+        duration_ms = seconds * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        
+        stages_ms = {stage: round(stage_seconds * 1000, 3) for stage, stage_seconds in timings.items()}
+        entry = {
+            'timestamp': time.time(),
+            'method': method,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(duration_ms, 3),
+            'stages_ms': stages_ms,
+            # Queueing, socket I/O and any work outside the timed stages
+            'other_ms': round(duration_ms - sum(stages_ms.values()), 3),
+            'request': dict(shape or {})
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+    
+    def entries(self):
+        """Recorded requests, newest first"""
+        with self._lock:
+            return list(reversed(self._entries))
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def to_dict(self):
+        return {
+            'threshold_ms': self.threshold_ms,
+            'max_entries': self._entries.maxlen,
+            'recorded': self.recorded,
+            'requests': self.entries()
+        }
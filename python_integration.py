@@ -4,73 +4,504 @@ Python Integration Service for YouTube Ad Blocker Pro
 Provides ML-based ad detection as a service for the Chrome extension
 """
 
+import asyncio
+import itertools
 import json
+import multiprocessing
+import queue
+import select
+import signal
+import socket
 import sys
 import os
+import tempfile
 import threading
 import time
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import logging
 
-from ml_detector import AdvancedAdDetector
+import columnar_format
+from feedback import FeedbackLearner, FeedbackLog
+from metrics import ServiceMetrics, merge_snapshots, retired_snapshot, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from page_sessions import PageSessionStore
+from profiling import ProfilerBusy, SlowRequestLog, collapsed_text, sample_stacks
+from forest_engine import PackedForest
+from ml_detector import AdvancedAdDetector, DEFAULT_FOREST_PARAMS, DEFAULT_MAX_TRAINING_ROWS, DEFAULT_RULES_PATH
+from url_rules import load_rule_engine
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def health_response(registry):
+    """Build the /health payload shared by the threaded and async services"""
+    detector = registry.get()
+    cache = detector.cache if detector is not None else None
+    cascade = detector.cascade if detector is not None else None
+    
+    return {
+        'status': 'healthy',
+        'model_loaded': registry.is_loaded,
+        'model_version': registry.version,
+        'prediction_cache': cache.stats() if cache is not None else None,
+        'feedback': registry.feedback.stats(),
+        'cascade': dict(cascade.stats(), enabled=detector.use_cascade) if cascade is not None else None,
+        'text_features': dict(
+            detector.text_features.stats(),
+            enabled=bool(detector.schema.text_columns) and detector.use_text_features
+        ) if detector is not None else None,
+        'page_sessions': registry.page_sessions.stats(),
+        'service': 'YouTube Ad Blocker Pro ML Service'
+    }
+
+def element_response(result):
+    """Shape one predict_batch result as a single-element /analyze response"""
+    if 'error' in result:
+        raise ValueError(result['error'])
+    
+    return {
+        'is_ad': result['is_ad'],
+        'confidence': result['confidence'],
+        'reasoning': result['reasoning'],
+        'timestamp': time.time()
+    }
+
+def batch_response(results):
+    """Shape predict_batch results as a /batch_analyze response"""
+    return {
+        'total_elements': len(results),
+        'ads_detected': sum(1 for r in results if r.get('is_ad', False)),
+        'results': results,
+        'timestamp': time.time()
+    }
+
+def json_body(data):
+    """Compact JSON; responses are for machines, not people"""
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def is_columnar(content_type):
+    return (content_type or '').split(';')[0].strip().lower() == columnar_format.CONTENT_TYPE
+
+def decode_batch_request(body, content_type):
+    """Elements of a /batch_analyze body, sent as JSON or in the columnar format
+    
+    Raises ValueError (JSONDecodeError and UnicodeDecodeError included) for bad input.
+    """
+    if is_columnar(content_type):
+        elements, _ = columnar_format.decode_rows(body)
+        return elements
+    
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError('Batch body must be a JSON object')
+    elements = payload.get('elements', [])
+    if not isinstance(elements, list):
+        raise ValueError("'elements' must be a list")
+    return elements
+
+# A response body that is already encoded, for the async service's dispatch
+EncodedBody = namedtuple('EncodedBody', ['body', 'content_type'])
+
+def timed(timings, stage, function, *args):
+    """Call function(*args), adding its duration in seconds to timings[stage]"""
+    started = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+# Paths reported under their own endpoint label; others are grouped so a scan
+# of random URLs cannot grow the metrics without bound
+METRIC_ENDPOINTS = {'/health', '/metrics', '/analyze', '/batch_analyze', '/batch_analyze_stream', '/analyze_page',
+                    '/match_urls', '/feedback', '/train', '/admin/profile', '/admin/slow_requests'}
+
+# /admin endpoints only answer clients on this machine
+LOOPBACK_ADDRESSES = {'127.0.0.1', '::1', '::ffff:127.0.0.1'}
+
+MAX_PROFILE_SECONDS = 60.0
+
+def endpoint_label(path):
+    if path in METRIC_ENDPOINTS:
+        return path
+    if path.startswith('/train/'):
+        return '/train/{job_id}'
+    return 'other'
+
+def match_urls_response(body, timings):
+    """Check a /match_urls body's URLs against rules.json; returns (status, data)
+    
+    The body is {"urls": [...], "resource_type": optional}. Without a
+    resource_type, the rules' resource type conditions are ignored.
+    """
+    try:
+        payload = timed(timings, 'json_decode', json.loads, body)
+        urls = payload.get('urls') if isinstance(payload, dict) else None
+        resource_type = payload.get('resource_type') if isinstance(payload, dict) else None
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            raise ValueError('urls must be a list of strings')
+    except ValueError:
+        return 400, {'error': 'Invalid URL data'}
+    
+    engine = load_rule_engine(DEFAULT_RULES_PATH)
+    if engine is None:
+        return 503, {'error': 'URL rules not loaded'}
+    
+    rules = timed(timings, 'match_urls', engine.match_urls, urls, resource_type)
+    results = [{'url': url, 'blocked': rule is not None and rule['action'] == 'block', 'rule': rule}
+               for url, rule in zip(urls, rules)]
+    return 200, {
+        'total_urls': len(results),
+        'blocked': sum(1 for r in results if r['blocked']),
+        'results': results,
+        'rules': engine.stats(),
+        'timestamp': time.time()
+    }
+
+def page_analysis_response(registry, body, timings):
+    """Score the new and changed elements of one page's session; returns (status, data)"""
+    try:
+        payload = timed(timings, 'json_decode', json.loads, body)
+        if not isinstance(payload, dict):
+            raise ValueError
+        session_id = payload.get('session_id')
+        elements = payload.get('elements', [])
+        removed = payload.get('removed', [])
+        if session_id is not None and not isinstance(session_id, str) \
+                or not isinstance(elements, list) or not all(isinstance(e, dict) for e in elements) \
+                or not isinstance(removed, list):
+            raise ValueError
+    except ValueError:
+        return 400, {'error': 'Invalid page data'}
+    
+    detector = registry.get()
+    if detector is None:
+        return 503, {'error': 'Model not loaded'}
+    
+    response = registry.page_sessions.analyze(detector, session_id, elements, bool(payload.get('full')),
+                                              removed, timings=timings)
+    response['timestamp'] = time.time()
+    return 200, response
+
+def is_admin_client(address):
+    return address in LOOPBACK_ADDRESSES
+
+def profile_response(query):
+    """Sample this process's threads for GET /admin/profile; returns (status, data)
+    
+    Query parameters are seconds (default 5), interval_ms (default 5) and
+    idle=1 to keep the stacks of blocked threads. On success data is the
+    collapsed-stack text, ready for flamegraph.pl or speedscope.
+    """
+    params = parse_qs(query)
+    try:
+        seconds = float(params.get('seconds', ['5'])[0])
+        interval_ms = float(params.get('interval_ms', ['5'])[0])
+        if not (0 < seconds <= MAX_PROFILE_SECONDS and 0.1 <= interval_ms <= 1000):
+            raise ValueError
+    except ValueError:
+        return 400, {'error': f'seconds must be in (0, {MAX_PROFILE_SECONDS:g}] and interval_ms in [0.1, 1000]'}
+    
+    try:
+        stacks, samples = sample_stacks(seconds, interval_ms / 1000, params.get('idle', ['0'])[0] == '1')
+    except ProfilerBusy as e:
+        return 409, {'error': str(e)}
+    logger.info(f"Profile finished: {samples} samples, {len(stacks)} distinct stacks")
+    return 200, collapsed_text(stacks)
+
+def slow_requests_response(slow_requests, method, body):
+    """The slow-request log for GET /admin/slow_requests; returns (status, data)
+    
+    POST {"threshold_ms": 100, "clear": true} changes the threshold and/or
+    empties the log first.
+    """
+    if method == 'POST':
+        try:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise ValueError
+            threshold = payload.get('threshold_ms', slow_requests.threshold_ms)
+            if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or threshold < 0:
+                raise ValueError
+        except ValueError:
+            return 400, {'error': 'Expected {"threshold_ms": non-negative number, "clear": boolean}'}
+        
+        slow_requests.threshold_ms = float(threshold)
+        if payload.get('clear'):
+            slow_requests.clear()
+    
+    return 200, slow_requests.to_dict()
+
+def training_response(training_jobs, body):
+    """Start a background training job for POST /train; returns (status, data)
+    
+    An optional JSON body selects the training mode, e.g.
+    {"search": true, "n_jobs": -1} for a parallel hyperparameter search, and
+    {"max_rows": N} caps the rows sampled from the training data.
+    """
+    try:
+        options = json.loads(body) if body.strip() else {}
+        if not isinstance(options, dict):
+            raise ValueError('Training options must be a JSON object')
+        max_rows = options.get('max_rows')
+        if max_rows is not None and (isinstance(max_rows, bool) or not isinstance(max_rows, int) or max_rows < 1):
+            raise ValueError('max_rows must be a positive integer')
+        
+        job, created = training_jobs.submit(
+            search=bool(options.get('search', False)),
+            n_jobs=options.get('n_jobs'),
+            max_rows=max_rows
+        )
+    except ValueError as e:
+        # JSONDecodeError is a ValueError too
+        return 400, {'error': str(e)}
+    except Exception as e:
+        logger.error(f"Training error: {e}")
+        return 500, {'error': str(e)}
+    
+    return 202 if created else 409, dict(job, status_url=f"/train/{job['job_id']}")
+
+def training_status_response(training_jobs, job_id):
+    """Status of a training job for GET /train/<job_id>; returns (status, data)"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return 404, {'error': f'Unknown training job: {job_id}'}
+    return 200, job
+
+def parse_feedback(payload):
+    """(elements, labels) from a /feedback body; raises ValueError if malformed
+    
+    The body is one report, {"element": {...}, "is_ad": true}, or several as
+    {"reports": [...]}. is_ad is the correct label: false for a false positive,
+    true for a missed ad.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('Feedback body must be a JSON object')
+    reports = payload.get('reports', [payload] if 'element' in payload else None)
+    if not isinstance(reports, list) or not reports:
+        raise ValueError('Expected "element" and "is_ad", or a non-empty "reports" list')
+    
+    elements, labels = [], []
+    for report in reports:
+        if not isinstance(report, dict) or not isinstance(report.get('element'), dict) \
+                or not isinstance(report.get('is_ad'), bool):
+            raise ValueError('Each report needs an "element" object and a boolean "is_ad"')
+        elements.append(report['element'])
+        labels.append(report['is_ad'])
+    return elements, labels
+
+def feedback_response(registry, body, timings):
+    """Record /feedback reports and apply them to the live model; returns (status, data)"""
+    try:
+        elements, labels = parse_feedback(timed(timings, 'json_decode', json.loads, body))
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    
+    if not registry.is_loaded:
+        return 503, {'error': 'Model not loaded'}
+    
+    try:
+        results = timed(timings, 'feedback_update', registry.feedback.submit, elements, labels)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+    return 200, {
+        'accepted': len(results),
+        'results': results,
+        'feedback': registry.feedback.stats(),
+        'timestamp': time.time()
+    }
+
+def wants_columnar(accept):
+    return columnar_format.CONTENT_TYPE in (accept or '').lower()
+
+def columnar_batch_response(results):
+    """Encode a /batch_analyze response in the columnar format
+    
+    The results become the rows; the summary fields travel as metadata.
+    """
+    response = batch_response(results)
+    return columnar_format.encode_rows(response.pop('results'), response)
+
 class AdDetectionAPI(BaseHTTPRequestHandler):
     """HTTP API for ad detection service"""
     
-    def __init__(self, *args, **kwargs):
-        self.detector = None
-        self.model_loaded = False
-        super().__init__(*args, **kwargs)
+    # Shared ModelRegistry, TrainingJobManager, ServiceMetrics and
+    # SlowRequestLog, injected by AdDetectionService when the handler class is built
+    registry = None
+    training_jobs = None
+    metrics = None
+    slow_requests = None
+    
+    # Keep-alive connections; idle ones are dropped after `timeout` seconds so they
+    # do not pin a pool worker forever
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+    
+    # Headers and body go out in separate writes; with Nagle on, the body of
+    # a keep-alive response waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+    
+    # Larger request bodies are refused with 413 instead of being buffered
+    max_body_size = 64 * 1024 * 1024
+    
+    # /batch_analyze_stream: elements scored per forest call, and the longest
+    # NDJSON line accepted
+    stream_chunk_size = 256
+    max_line_size = 1024 * 1024
     
     def do_GET(self):
         """Handle GET requests"""
+        self.instrumented(self.route_get)
+    
+    def do_POST(self):
+        """Handle POST requests for analysis"""
+        self.instrumented(self.route_post)
+    
+    def instrumented(self, route):
+        """Serve one request, recording its status, latency and stage timings"""
+        self.response_status = None
+        self.timings = {}
+        content_length = self.headers.get('Content-Length', '')
+        self.request_shape = {
+            'bytes': int(content_length) if content_length.isdigit() else None,
+            'content_type': self.headers.get('Content-Type')
+        }
+        if self.metrics is None:
+            route()
+            return
+        
+        self.metrics.request_started()
+        started = time.perf_counter()
+        try:
+            route()
+        finally:
+            seconds = time.perf_counter() - started
+            endpoint = endpoint_label(urlparse(self.path).path)
+            status = self.response_status or 500
+            self.metrics.request_finished(self.command, endpoint, status, seconds)
+            self.metrics.observe_stages(self.timings)
+            if self.slow_requests is not None:
+                self.slow_requests.record(self.command, endpoint, status, seconds, self.timings, self.request_shape)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+        if getattr(self.server, 'draining', False):
+            # A pre-fork worker being replaced sends keep-alive clients to its siblings
+            self.send_header('Connection', 'close')
+    
+    def timed(self, stage, function, *args):
+        """Call function(*args), adding its duration to this request's stage timings"""
+        return timed(self.timings, stage, function, *args)
+    
+    def predict(self, detector, elements):
+        """predict_batch with its stage timings and batch size recorded"""
+        if self.metrics is not None:
+            self.metrics.observe_batch(len(elements))
+        self.request_shape['elements'] = self.request_shape.get('elements', 0) + len(elements)
+        return detector.predict_batch(elements, timings=self.timings)
+    
+    def route_get(self):
         parsed_path = urlparse(self.path)
         
         if parsed_path.path == '/health':
             self.send_health_check()
+        elif parsed_path.path == '/metrics' and self.metrics is not None:
+            self.send_metrics()
         elif parsed_path.path == '/analyze':
             self.handle_analysis(parsed_path)
         elif parsed_path.path == '/train':
+            # Kept for older clients; starts a background job like POST /train
             self.handle_training()
+        elif parsed_path.path.startswith('/train/'):
+            self.send_training_status(parsed_path.path[len('/train/'):])
+        elif parsed_path.path.startswith('/admin/'):
+            self.handle_admin(parsed_path)
         else:
             self.send_error(404, "Endpoint not found")
     
-    def do_POST(self):
-        """Handle POST requests for analysis"""
+    def route_post(self):
         parsed_path = urlparse(self.path)
         
+        if parsed_path.path == '/batch_analyze_stream':
+            # Reads its own body as it goes
+            self.analyze_stream()
+            return
+        
+        if parsed_path.path not in ('/analyze', '/batch_analyze', '/analyze_page', '/match_urls', '/feedback',
+                                    '/train', '/admin/slow_requests'):
+            self.send_error(404, "Endpoint not found")
+            return
+        if parsed_path.path.startswith('/admin/') and not self.admin_allowed():
+            self.close_connection = True
+            return
+        
+        post_data = self.read_body()
+        if post_data is None:
+            return
+        
         if parsed_path.path == '/analyze':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
             self.analyze_element(post_data)
         elif parsed_path.path == '/batch_analyze':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
             self.analyze_batch(post_data)
+        elif parsed_path.path == '/analyze_page':
+            self.send_json_response(*page_analysis_response(self.registry, post_data, self.timings))
+        elif parsed_path.path == '/match_urls':
+            self.send_json_response(*match_urls_response(post_data, self.timings))
+        elif parsed_path.path == '/feedback':
+            self.send_json_response(*feedback_response(self.registry, post_data, self.timings))
+        elif parsed_path.path == '/admin/slow_requests':
+            self.send_json_response(*slow_requests_response(self.slow_requests, 'POST', post_data))
         else:
-            self.send_error(404, "Endpoint not found")
+            self.handle_training(post_data)
+    
+    def read_body(self):
+        """Read the request body into a single buffer, or send an error and return None"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        
+        if content_length < 0 or content_length > self.max_body_size:
+            # The unread body would be taken for the next request, so drop the connection
+            self.close_connection = True
+            if content_length < 0:
+                self.send_error(400, "Invalid Content-Length")
+            else:
+                self.send_json_response(413, {'error': f'Request body exceeds {self.max_body_size} bytes'})
+            return None
+        
+        # readinto fills one preallocated buffer; the columnar decoder reads
+        # fixed-width columns straight out of it
+        body = bytearray(content_length)
+        if content_length and self.rfile.readinto(body) != content_length:
+            self.close_connection = True
+            return None
+        return body
+    
+    def send_metrics(self):
+        """Send the Prometheus metrics, or 503 if a prefork worker cannot reach its supervisor"""
+        try:
+            text = self.metrics.render(self.registry)
+        except (OSError, RuntimeError) as e:
+            self.send_json_response(503, {'error': f'Metrics unavailable: {e}'})
+            return
+        self.send_body(200, text.encode('utf-8'), METRICS_CONTENT_TYPE)
     
     def send_health_check(self):
         """Send health check response"""
-        response = {
-            'status': 'healthy',
-            'model_loaded': self.model_loaded,
-            'service': 'YouTube Ad Blocker Pro ML Service'
-        }
-        self.send_json_response(200, response)
+        self.send_json_response(200, health_response(self.registry))
     
     def handle_analysis(self, parsed_path):
         """Handle analysis with query parameters"""
         query_params = parse_qs(parsed_path.query)
         
-        # Initialize detector if not loaded
-        if not self.model_loaded:
-            self.initialize_detector()
+        detector = self.get_detector()
+        if detector is None:
+            return
         
         # Extract element data from query
         element_data = {}
@@ -81,17 +512,7 @@ class AdDetectionAPI(BaseHTTPRequestHandler):
         # Perform analysis
         if element_data:
             try:
-                probability = self.detector.predict_ad_probability(element_data)
-                is_ad = self.detector.is_ad(element_data)
-                reasoning = self.detector.get_reasoning(element_data, probability)
-                
-                response = {
-                    'is_ad': is_ad,
-                    'confidence': probability,
-                    'reasoning': reasoning,
-                    'timestamp': time.time()
-                }
-                
+                response = self.score_element(detector, element_data)
                 self.send_json_response(200, response)
             except Exception as e:
                 logger.error(f"Analysis error: {e}")
@@ -102,22 +523,13 @@ class AdDetectionAPI(BaseHTTPRequestHandler):
     def analyze_element(self, post_data):
         """Analyze element from POST data"""
         try:
-            element_data = json.loads(post_data.decode('utf-8'))
-            
-            if not self.model_loaded:
-                self.initialize_detector()
-            
-            probability = self.detector.predict_ad_probability(element_data)
-            is_ad = self.detector.is_ad(element_data)
-            reasoning = self.detector.get_reasoning(element_data, probability)
+            element_data = self.timed('json_decode', json.loads, post_data)
             
-            response = {
-                'is_ad': is_ad,
-                'confidence': probability,
-                'reasoning': reasoning,
-                'timestamp': time.time()
-            }
+            detector = self.get_detector()
+            if detector is None:
+                return
             
+            response = self.score_element(detector, element_data)
             self.send_json_response(200, response)
             
         except json.JSONDecodeError:
@@ -126,133 +538,568 @@ class AdDetectionAPI(BaseHTTPRequestHandler):
             logger.error(f"Analysis error: {e}")
             self.send_json_response(500, {'error': str(e)})
     
+    def score_element(self, detector, element_data):
+        """Score one element with a single feature extraction and forest call"""
+        return element_response(self.predict(detector, [element_data])[0])
+    
     def analyze_batch(self, post_data):
-        """Analyze multiple elements"""
+        """Analyze multiple elements, sent and answered as JSON or columnar data"""
         try:
-            batch_data = json.loads(post_data.decode('utf-8'))
-            elements = batch_data.get('elements', [])
-            
-            if not self.model_loaded:
-                self.initialize_detector()
-            
-            results = []
-            for element_data in elements:
-                try:
-                    probability = self.detector.predict_ad_probability(element_data)
-                    is_ad = self.detector.is_ad(element_data)
-                    reasoning = self.detector.get_reasoning(element_data, probability)
-                    
-                    results.append({
-                        'element_id': element_data.get('id'),
-                        'is_ad': is_ad,
-                        'confidence': probability,
-                        'reasoning': reasoning
-                    })
-                except Exception as e:
-                    results.append({
-                        'element_id': element_data.get('id'),
-                        'error': str(e)
-                    })
-            
-            response = {
-                'total_elements': len(elements),
-                'ads_detected': sum(1 for r in results if r.get('is_ad', False)),
-                'results': results,
-                'timestamp': time.time()
-            }
+            content_type = self.headers.get('Content-Type')
+            stage = 'columnar_decode' if is_columnar(content_type) else 'json_decode'
+            elements = self.timed(stage, decode_batch_request, post_data, content_type)
+        except ValueError:
+            self.send_error(400, "Invalid batch data")
+            return
+        
+        try:
+            detector = self.get_detector()
+            if detector is None:
+                return
             
-            self.send_json_response(200, response)
+            # One feature matrix and one forest evaluation for the whole batch
+            results = self.predict(detector, elements)
+            if wants_columnar(self.headers.get('Accept')):
+                body = self.timed('columnar_encode', columnar_batch_response, results)
+                self.send_body(200, body, columnar_format.CONTENT_TYPE)
+            else:
+                self.send_json_response(200, batch_response(results))
             
-        except json.JSONDecodeError:
-            self.send_error(400, "Invalid JSON data")
         except Exception as e:
             logger.error(f"Batch analysis error: {e}")
             self.send_json_response(500, {'error': str(e)})
     
-    def handle_training(self):
-        """Handle model training request"""
-        try:
-            if self.detector:
-                accuracy = self.detector.train_model()
-                self.model_loaded = True
-                
-                response = {
-                    'status': 'training_complete',
-                    'accuracy': accuracy,
-                    'timestamp': time.time()
-                }
-                
-                self.send_json_response(200, response)
+    def analyze_stream(self):
+        """Score newline-delimited element JSON in fixed-size chunks, streaming NDJSON results
+        
+        Each input line gets one result line, in order. Results for a chunk are
+        written as soon as it is scored, so neither side holds the whole batch.
+        """
+        detector = self.get_detector()
+        if detector is None:
+            # The body was never read
+            self.close_connection = True
+            return
+        
+        # Chunked framing needs an HTTP/1.1 client; older ones get the stream
+        # unframed, ended by closing the connection
+        chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+        self.end_headers()
+        
+        def write(data):
+            if chunked:
+                self.wfile.write(f'{len(data):x}\r\n'.encode('latin-1') + data + b'\r\n')
             else:
-                self.send_error(500, "Detector not initialized")
+                self.wfile.write(data)
+        
+        def flush(chunk):
+            # Lines that were not JSON objects keep their place with an error result
+            predictions = iter(self.predict(detector, [element for element in chunk if element is not None]))
+            results = [next(predictions) if element is not None else {'element_id': None, 'error': 'Invalid JSON element'}
+                       for element in chunk]
+            write(self.timed('json_encode', lambda: b''.join(json_body(result) + b'\n' for result in results)))
+        
+        try:
+            chunk = []
+            for line in self.iter_body_lines():
+                if not line.strip():
+                    continue
+                try:
+                    element_data = self.timed('json_decode', json.loads, line)
+                except ValueError:
+                    element_data = None
+                chunk.append(element_data if isinstance(element_data, dict) else None)
                 
-        except Exception as e:
-            logger.error(f"Training error: {e}")
-            self.send_json_response(500, {'error': str(e)})
+                if len(chunk) >= self.stream_chunk_size:
+                    flush(chunk)
+                    chunk = []
+            
+            if chunk:
+                flush(chunk)
+        except (ValueError, OSError) as e:
+            # Headers are already out; report in-band and drop the connection
+            logger.error(f"Stream analysis error: {e}")
+            self.close_connection = True
+            try:
+                write(json_body({'error': str(e)}) + b'\n')
+            except OSError:
+                return
+        
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
     
-    def initialize_detector(self):
-        """Initialize the ML detector"""
-        try:
-            if not self.detector:
-                self.detector = AdvancedAdDetector()
+    def iter_body_lines(self):
+        """Yield the request body line by line, from a Content-Length or chunked upload"""
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                line = self.rfile.readline(min(remaining, self.max_line_size + 1))
+                if not line:
+                    raise ConnectionError('Request body ended early')
+                if len(line) > self.max_line_size:
+                    raise ValueError(f'Line exceeds {self.max_line_size} bytes')
+                remaining -= len(line)
+                yield line
+            return
+        
+        partial = b''
+        while True:
+            size = int(self.rfile.readline(64).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailer fields up to the blank line ending the body
+                while self.rfile.readline(self.max_line_size) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            if size > self.max_line_size:
+                raise ValueError(f'Upload chunk exceeds {self.max_line_size} bytes')
             
-            # Try to load existing model
-            if not self.model_loaded:
-                self.model_loaded = self.detector.load_model()
-                
-            # Train new model if not loaded
-            if not self.model_loaded:
-                logger.info("Training new model...")
-                accuracy = self.detector.train_model()
-                self.model_loaded = True
-                logger.info(f"Model trained with accuracy: {accuracy:.2f}")
-                
-        except Exception as e:
-            logger.error(f"Detector initialization error: {e}")
-            self.model_loaded = False
+            *lines, partial = (partial + self.rfile.read(size)).split(b'\n')
+            self.rfile.readline(64)
+            if len(partial) > self.max_line_size:
+                raise ValueError(f'Line exceeds {self.max_line_size} bytes')
+            yield from lines
+        
+        if partial:
+            yield partial
+    
+    def handle_training(self, post_data=b''):
+        """Start a background training job and return its id"""
+        self.send_json_response(*training_response(self.training_jobs, post_data))
+    
+    def send_training_status(self, job_id):
+        """Send the status of a training job"""
+        self.send_json_response(*training_status_response(self.training_jobs, job_id))
+    
+    def admin_allowed(self):
+        """True for /admin clients on this machine; others get a 403"""
+        if is_admin_client(self.client_address[0]):
+            return True
+        self.send_json_response(403, {'error': 'Admin endpoints are only served to local clients'})
+        return False
+    
+    def handle_admin(self, parsed_path):
+        """GET /admin/profile and /admin/slow_requests"""
+        if not self.admin_allowed():
+            return
+        
+        if parsed_path.path == '/admin/profile':
+            status, data = profile_response(parsed_path.query)
+            if status == 200:
+                self.send_body(200, data.encode('utf-8'), 'text/plain; charset=utf-8')
+            else:
+                self.send_json_response(status, data)
+        elif parsed_path.path == '/admin/slow_requests' and self.slow_requests is not None:
+            self.send_json_response(*slow_requests_response(self.slow_requests, 'GET', None))
+        else:
+            self.send_error(404, "Endpoint not found")
+    
+    def get_detector(self):
+        """Return the shared detector, or send 503 if no model is loaded yet"""
+        detector = self.registry.get()
+        if detector is None:
+            self.send_json_response(503, {'error': 'Model not loaded'})
+        return detector
     
     def send_json_response(self, status_code, data):
         """Send JSON response"""
+        self.send_body(status_code, self.timed('json_encode', json_body, data), 'application/json')
+    
+    def send_body(self, status_code, body, content_type):
+        """Send an encoded response body"""
         self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
         
-        json_data = json.dumps(data, indent=2)
-        self.wfile.write(json_data.encode('utf-8'))
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
         """Override to reduce log spam"""
         pass  # Disable default logging
 
+class BoundedThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that serves connections on a fixed worker pool and sheds load when full"""
+    
+    def __init__(self, server_address, handler_class, workers=8, max_queue=64, bind_and_activate=True):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ml-worker')
+        
+        # One slot per running or queued connection; beyond that clients get a 503
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        
+        # Set up before binding: a failed bind calls server_close on the way out
+        super().__init__(server_address, handler_class, bind_and_activate)
+    
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker, or reject it when the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            self.reject_request(request)
+            return
+        
+        try:
+            self.executor.submit(self.process_request_worker, request, client_address)
+        except RuntimeError:
+            # Executor already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+    
+    def process_request_worker(self, request, client_address):
+        """Handle one connection (including keep-alive requests) on a pool thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+    
+    def reject_request(self, request):
+        """Answer 503 straight on the socket without tying up a worker"""
+        metrics = getattr(self.RequestHandlerClass, 'metrics', None)
+        if metrics is not None:
+            metrics.request_rejected()
+        
+        body = json_body({'error': 'Server overloaded, retry later'})
+        head = (
+            'HTTP/1.1 503 Service Unavailable\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Retry-After: 1\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+            'Connection: close\r\n\r\n'
+        )
+        try:
+            request.sendall(head.encode('latin-1') + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+# Connection count of a pre-fork slot with no live worker; never the minimum
+IDLE_SLOT = 2 ** 62
+
+class PreforkWorkerHTTPServer(BoundedThreadPoolHTTPServer):
+    """Worker-process server that accepts only while no sibling has fewer open connections"""
+    
+    # How long a worker that is not the least loaded waits before looking again
+    defer_seconds = 0.0005
+    
+    def __init__(self, listen_socket, handler_class, connections, slot, workers=8, max_queue=64):
+        super().__init__(listen_socket.getsockname()[:2], handler_class, workers, max_queue,
+                         bind_and_activate=False)
+        self.socket = listen_socket
+        self.connections = connections
+        self.slot = slot
+        self.draining = False
+        self._count_lock = threading.Lock()
+    
+    def get_request(self):
+        # OSErrors here are ignored by the accept loop, which simply polls again
+        if self.connections[self.slot] > min(self.connections):
+            time.sleep(self.defer_seconds)
+            raise BlockingIOError('A less loaded worker takes this connection')
+        
+        # The socket is non-blocking: a sibling may have taken the connection already
+        request, client_address = self.socket.accept()
+        request.setblocking(True)
+        with self._count_lock:
+            self.connections[self.slot] += 1
+        return request, client_address
+    
+    def shutdown_request(self, request):
+        with self._count_lock:
+            self.connections[self.slot] -= 1
+        super().shutdown_request(request)
+
+class ModelRegistry:
+    """Process-wide owner of the live detector shared by every request handler"""
+    
+    def __init__(self, model_path='ad_detector_model.pkl', cascade=False):
+        self.model_path = model_path
+        self.cascade = cascade
+        # Feedback reports live next to the model and carry over to each new one
+        self.feedback = FeedbackLearner(FeedbackLog.path_for(model_path))
+        # Incremental page analysis state; it records the model version each
+        # verdict was made with, so it survives a publish
+        self.page_sessions = PageSessionStore()
+        self._detector = None
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    def load(self):
+        """Load the model from disk and publish it; returns False if there is none"""
+        detector = self.create_detector()
+        
+        if not detector.load_model(self.model_path):
+            return False
+        
+        self.publish(detector)
+        return True
+    
+    def create_detector(self):
+        """A new, unloaded detector configured for this service"""
+        return AdvancedAdDetector(cascade=self.cascade)
+    
+    def publish(self, detector):
+        """Atomically swap in a new trained detector"""
+        try:
+            self.feedback.attach(detector)
+        except Exception as e:
+            logger.error(f"Serving without feedback corrections: {e}")
+        
+        with self._lock:
+            self._detector = detector
+            self._version += 1
+            version = self._version
+        
+        logger.info(f"Published model version {version}")
+    
+    def get(self):
+        """Return the current detector, or None before the first publish"""
+        return self._detector
+    
+    @property
+    def version(self):
+        return self._version
+    
+    @property
+    def is_loaded(self):
+        return self._detector is not None
+
+def run_training_job(model_path, dataset_path, messages, search=False, n_jobs=None,
+                     max_rows=DEFAULT_MAX_TRAINING_ROWS):
+    """Child-process entry point: train, save atomically and report back over a queue"""
+    try:
+        detector = AdvancedAdDetector()
+        accuracy = detector.train_model(
+            dataset_path, model_path=model_path,
+            progress=lambda stage, fraction: messages.put(('progress', stage, fraction)),
+            max_rows=max_rows, search=search, n_jobs=n_jobs
+        )
+        params = detector.model.get_params()
+        messages.put(('done', float(accuracy), {name: params[name] for name in DEFAULT_FOREST_PARAMS}))
+    except Exception as e:
+        messages.put(('error', str(e)))
+
+class TrainingJobManager:
+    """Runs training in a separate process and publishes the new model when it finishes"""
+    
+    max_jobs_kept = 20
+    
+    def __init__(self, registry, dataset_path=None, max_rows=DEFAULT_MAX_TRAINING_ROWS, publish=None,
+                 monitor=True):
+        self.registry = registry
+        self.dataset_path = dataset_path
+        self.max_rows = max_rows
+        # Makes a finished job's model live; returns its version
+        self.publish = publish or self.load_and_publish
+        # Without a monitor thread the owner calls poll() regularly
+        self.monitor = monitor
+        self.jobs = OrderedDict()
+        self._active_job_id = None
+        self._active_process = None
+        self._active_messages = None
+        self._lock = threading.Lock()
+        # spawn, not fork: the parent is multi-threaded and must not fork held locks
+        self._context = multiprocessing.get_context('spawn')
+    
+    def submit(self, search=False, n_jobs=None, max_rows=None):
+        """Start a job; returns (job, created), or the running job with created=False"""
+        max_rows = max_rows or self.max_rows
+        with self._lock:
+            if self._active_job_id is not None:
+                return dict(self.jobs[self._active_job_id]), False
+            
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                'job_id': job_id,
+                'status': 'running',
+                'stage': 'starting',
+                'progress': 0.0,
+                'created': time.time(),
+                'finished': None,
+                'search': search,
+                'max_rows': max_rows,
+                'accuracy': None,
+                'forest_params': None,
+                'model_version': None,
+                'error': None
+            }
+            self.jobs[job_id] = job
+            self._active_job_id = job_id
+            while len(self.jobs) > self.max_jobs_kept:
+                self.jobs.popitem(last=False)
+        
+        messages = self._context.Queue()
+        process = self._context.Process(
+            target=run_training_job,
+            args=(self.registry.model_path, self.dataset_path, messages, search, n_jobs, max_rows),
+            # Not a daemon: a search job starts its own worker pool. shutdown()
+            # stops it instead when the service goes away
+            daemon=False
+        )
+        process.start()
+        self._active_process = process
+        self._active_messages = messages
+        
+        if self.monitor:
+            monitor = threading.Thread(target=self._monitor, args=(job_id, process, messages))
+            monitor.daemon = True
+            monitor.start()
+        
+        logger.info(f"Training job {job_id} started (pid {process.pid})")
+        return dict(job), True
+    
+    def shutdown(self):
+        """Stop a running job so it does not outlive the service"""
+        process = self._active_process
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(timeout=5)
+    
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+    
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self.jobs[job_id].update(fields)
+    
+    def poll(self):
+        """Apply the running job's progress, and publish its model if it has finished"""
+        job_id, process, messages = self._active_job_id, self._active_process, self._active_messages
+        if job_id is not None:
+            outcome = self._receive(job_id, process, messages, timeout=0)
+            if outcome is not None:
+                self._finish(job_id, process, outcome)
+    
+    def load_and_publish(self):
+        """Load the model the child wrote and swap it into the registry; returns its version"""
+        # The child already renamed the finished model into place
+        detector = self.registry.create_detector()
+        if not detector.load_model(self.registry.model_path):
+            raise RuntimeError(f'Could not load trained model from {self.registry.model_path}')
+        self.registry.publish(detector)
+        return self.registry.version
+    
+    def _monitor(self, job_id, process, messages):
+        """Follow the child's progress messages and publish the model when it is done"""
+        outcome = None
+        while outcome is None:
+            outcome = self._receive(job_id, process, messages, timeout=1.0)
+        self._finish(job_id, process, outcome)
+    
+    def _receive(self, job_id, process, messages, timeout):
+        """Apply queued progress messages; returns the job's outcome once it has one"""
+        while True:
+            try:
+                message = messages.get(timeout=timeout)
+            except queue.Empty:
+                if not process.is_alive():
+                    return ('error', f'Training process exited with code {process.exitcode}')
+                return None
+            
+            if message[0] == 'progress':
+                self._update(job_id, stage=message[1], progress=message[2])
+            else:
+                return message
+    
+    def _finish(self, job_id, process, outcome):
+        process.join()
+        
+        if outcome[0] == 'done':
+            try:
+                model_version = self.publish()
+                self._update(job_id, status='completed', stage='published', progress=1.0,
+                             accuracy=outcome[1], forest_params=outcome[2],
+                             model_version=model_version)
+                logger.info(f"Training job {job_id} completed with accuracy {outcome[1]:.2f}")
+            except Exception as e:
+                outcome = ('error', str(e))
+        
+        if outcome[0] == 'error':
+            self._update(job_id, status='failed', error=outcome[1])
+            logger.error(f"Training job {job_id} failed: {outcome[1]}")
+        
+        with self._lock:
+            self.jobs[job_id]['finished'] = time.time()
+            self._active_job_id = None
+            self._active_process = None
+            self._active_messages = None
+
 class AdDetectionService:
     """Main service class for running the ML server"""
     
-    def __init__(self, host='localhost', port=8080):
+    def __init__(self, host='localhost', port=8080, model_path='ad_detector_model.pkl',
+                 workers=8, max_queue=64, cascade=False, slow_request_ms=250.0,
+                 dataset_path=None, max_training_rows=DEFAULT_MAX_TRAINING_ROWS):
         self.host = host
         self.port = port
+        self.workers = workers
+        self.max_queue = max_queue
         self.server = None
         self.server_thread = None
+        self.registry = ModelRegistry(model_path, cascade)
+        self.training_jobs = TrainingJobManager(self.registry, dataset_path, max_training_rows)
+        self.metrics = ServiceMetrics()
+        self.slow_requests = SlowRequestLog(slow_request_ms)
         
     def start_service(self):
         """Start the ML detection service"""
         try:
+            # Load the model once; every handler shares it through the registry.
+            # Without a model on disk, train one in the background and answer 503 meanwhile
+            if not self.registry.load():
+                logger.info("No saved model found, starting background training...")
+                self.training_jobs.submit()
+            
             # Create custom handler with detector
-            handler = type('MLHandler', (AdDetectionAPI,), {})
-            self.server = HTTPServer((self.host, self.port), handler)
+            handler = type('MLHandler', (AdDetectionAPI,), {
+                'registry': self.registry,
+                'training_jobs': self.training_jobs,
+                'metrics': self.metrics,
+                'slow_requests': self.slow_requests
+            })
+            self.server = BoundedThreadPoolHTTPServer(
+                (self.host, self.port), handler,
+                workers=self.workers, max_queue=self.max_queue
+            )
             
             # Start in separate thread
             self.server_thread = threading.Thread(target=self.server.serve_forever)
             self.server_thread.daemon = True
             self.server_thread.start()
             
-            logger.info(f"ML Detection Service started on {self.host}:{self.port}")
+            logger.info(f"ML Detection Service started on {self.host}:{self.port} "
+                        f"({self.workers} workers, queue limit {self.max_queue})")
             logger.info("API Endpoints:")
             logger.info("  GET  /health - Health check")
+            logger.info("  GET  /metrics - Prometheus metrics")
             logger.info("  GET  /analyze - Analyze single element (query params)")
             logger.info("  POST /analyze - Analyze single element (JSON)")
             logger.info("  POST /batch_analyze - Analyze multiple elements")
-            logger.info("  GET  /train - Train new model")
+            logger.info("  POST /batch_analyze_stream - Analyze NDJSON elements, streaming NDJSON results")
+            logger.info("  POST /analyze_page - Analyze a page's new and changed elements")
+            logger.info("  POST /match_urls - Match URLs against the extension's rules.json")
+            logger.info("  POST /feedback - Report a false positive or missed ad")
+            logger.info("  GET  /admin/profile?seconds=N - Sample stacks for N seconds (local clients only)")
+            logger.info("  GET  /admin/slow_requests - Recent requests over the slow-request threshold")
+            logger.info("  POST /train - Start background training job")
+            logger.info("  GET  /train/<job_id> - Training job status")
             
             return True
             
@@ -264,11 +1111,788 @@ class AdDetectionService:
         """Stop the ML detection service"""
         if self.server:
             self.server.shutdown()
+            self.server.server_close()
+            self.training_jobs.shutdown()
+            self.registry.feedback.close()
+            logger.info("ML Detection Service stopped")
+    
+    def is_running(self):
+        """Check if service is running"""
+        return self.server_thread and self.server_thread.is_alive()
+
+class SupervisorClient:
+    """A prefork worker's connection to its supervisor; stands in for TrainingJobManager"""
+    
+    # Seconds to wait for the supervisor, which may be busy rolling out a model
+    timeout = 5.0
+    
+    def __init__(self, path, worker_id):
+        self.path = path
+        self.worker_id = worker_id
+    
+    def call(self, op, **fields):
+        """Send one request over the control socket and return the supervisor's result"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(self.timeout)
+            conn.connect(self.path)
+            conn.sendall(json_body(dict(fields, op=op, worker=self.worker_id)) + b'\n')
+            with conn.makefile('rb') as reply_file:
+                line = reply_file.readline()
+        if not line:
+            raise ConnectionError('Supervisor closed the control connection')
+        
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise (ValueError if reply.get('invalid') else RuntimeError)(reply['error'])
+        return reply['result']
+    
+    def submit(self, search=False, n_jobs=None, max_rows=None):
+        job, created = self.call('submit', search=search, n_jobs=n_jobs, max_rows=max_rows)
+        return job, created
+    
+    def get(self, job_id):
+        return self.call('job', job_id=job_id)
+    
+    def shutdown(self):
+        """Jobs run under the supervisor, which stops them itself"""
+
+class PreforkWorkerMetrics(ServiceMetrics):
+    """One prefork worker's metrics, rendered as the sum over every worker the supervisor has run"""
+    
+    def __init__(self, supervisor):
+        super().__init__()
+        self.supervisor = supervisor
+    
+    def report(self, registry):
+        self.supervisor.call('metrics', snapshot=self.snapshot(registry))
+    
+    def render(self, registry=None):
+        total = self.supervisor.call('metrics', snapshot=self.snapshot(registry), total=True)
+        return self.render_snapshot(total)
+
+class PreforkAdDetectionService:
+    """Supervisor of a pool of pre-forked worker processes sharing one listening socket"""
+    
+    # Seconds between checks for exited workers and a changed model file
+    check_interval = 0.5
+    # Workers dying sooner than this after starting are restarted with a growing delay
+    min_uptime = 5.0
+    max_restart_delay = 30.0
+    # How long a new worker may take to start accepting, and an old one to finish
+    ready_timeout = 10.0
+    drain_timeout = 30.0
+    # Connections the kernel queues while every worker is busy
+    backlog = 128
+    # Longest control request a worker may send (a metrics snapshot)
+    max_control_message = 4 * 1024 * 1024
+    
+    def __init__(self, host='localhost', port=8080, model_path='ad_detector_model.pkl',
+                 processes=None, workers=4, max_queue=64, cascade=False, slow_request_ms=250.0,
+                 dataset_path=None, max_training_rows=DEFAULT_MAX_TRAINING_ROWS):
+        self.host = host
+        self.port = port
+        self.processes = processes or os.cpu_count() or 1
+        self.workers = workers
+        self.max_queue = max_queue
+        self.slow_request_ms = slow_request_ms
+        self.registry = ModelRegistry(model_path, cascade)
+        # Polled from the supervisor loop: the supervisor keeps to one thread
+        self.training_jobs = TrainingJobManager(self.registry, dataset_path, max_training_rows,
+                                                publish=self._publish_trained, monitor=False)
+        self.socket = None
+        self.connections = None
+        self.control = None
+        self.control_path = None
+        self.children = {}
+        self._worker_ids = itertools.count(1)
+        self._worker_metrics = {}
+        self._retired_metrics = None
+        self._retired_workers = set()
+        self._model_mtime = None
+        self._pending_mtime = None
+        self._restart_delay = 0.0
+        self._reload = threading.Event()
+        self._stop = threading.Event()
+        self._supervising = threading.Lock()
+    
+    def start_service(self):
+        """Load the model, bind the sockets and fork the workers; call from the main thread"""
+        try:
+            # Forking while another thread holds a lock leaves it held in the child
+            if threading.current_thread() is not threading.main_thread():
+                raise RuntimeError('The prefork service must be started from the main thread')
+            
+            self._model_mtime = self.model_mtime()
+            if not self.registry.load():
+                logger.info("No saved model found, starting background training...")
+                self.training_jobs.submit()
+            
+            self.socket = socket.create_server((self.host, self.port), backlog=self.backlog)
+            self.socket.setblocking(False)
+            self.port = self.socket.getsockname()[1]
+            
+            # Workers send training requests and metrics to the supervisor here
+            self.control_path = os.path.join(tempfile.mkdtemp(prefix='adblock-ml-'), 'control.sock')
+            self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.control.bind(self.control_path)
+            self.control.listen(self.backlog)
+            self.control.setblocking(False)
+            
+            # Open connections per worker slot, in memory every fork shares; a
+            # replacement takes a fresh slot while the worker it replaces drains
+            self.connections = multiprocessing.RawArray('q', 2 * self.processes)
+            self.connections[:] = [IDLE_SLOT] * len(self.connections)
+            for _ in range(self.processes):
+                self._spawn()
+            
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._reload.set())
+            
+            logger.info(f"ML Detection Service started on {self.host}:{self.port} "
+                        f"({self.processes} processes x {self.workers} workers)")
+            logger.info("Reload the model on every worker with SIGHUP, or by replacing the model file")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to start service: {e}")
+            return False
+    
+    def supervise(self):
+        """Restart workers, roll out models and answer workers until stop_service; blocks the main thread"""
+        with self._supervising:
+            while not self._stop.is_set():
+                self._serve_control(self.check_interval)
+                self.training_jobs.poll()
+                
+                for pid in list(self.children):
+                    try:
+                        done, status = os.waitpid(pid, os.WNOHANG)
+                    except ChildProcessError:
+                        done, status = pid, 0
+                    if done:
+                        self._worker_exited(pid, status)
+                
+                # Roll out once the model files have stopped changing for a check
+                mtime = self.model_mtime()
+                if mtime != self._model_mtime and mtime != self._pending_mtime:
+                    self._pending_mtime = mtime
+                elif self._reload.is_set() or (mtime is not None and mtime != self._model_mtime):
+                    self._reload.clear()
+                    self._model_mtime = self._pending_mtime = mtime
+                    self._roll_out()
+    
+    def stop_service(self):
+        """Drain and stop every worker, then the supervisor"""
+        if self.socket is None:
+            return
+        self._stop.set()
+        # Wait for a supervise() loop to finish its current step
+        with self._supervising:
+            pass
+        
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        for pid in list(self.children):
+            self._stop_worker(pid, signal_sent=True)
+        
+        self.training_jobs.shutdown()
+        self.control.close()
+        os.unlink(self.control_path)
+        os.rmdir(os.path.dirname(self.control_path))
+        self.socket.close()
+        self.socket = None
+        self.registry.feedback.close()
+        logger.info("ML Detection Service stopped")
+    
+    def is_running(self):
+        """Check if service is running"""
+        return self.socket is not None and not self._stop.is_set()
+    
+    def model_mtime(self):
+        """Newest modification time of the model and its packed artifact, or None"""
+        paths = (self.registry.model_path, PackedForest.path_for(self.registry.model_path))
+        mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+        return max(mtimes) if mtimes else None
+    
+    def _publish_trained(self):
+        """Publish step of the supervisor's training jobs: roll the new model out to every worker"""
+        self._model_mtime = self._pending_mtime = self.model_mtime()
+        if not self._roll_out():
+            raise RuntimeError(f'Could not load trained model from {self.registry.model_path}')
+        return self.registry.version
+    
+    def _spawn(self):
+        """Fork a worker on a free slot and wait until it is accepting; returns its pid"""
+        used = {slot for slot, _, _ in self.children.values()}
+        slot = next(i for i in range(len(self.connections)) if i not in used)
+        self.connections[slot] = 0
+        worker_id = next(self._worker_ids)
+        
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            self._run_worker(slot, worker_id, ready_write)
+        
+        os.close(ready_write)
+        self.children[pid] = (slot, time.monotonic(), worker_id)
+        # The pipe also becomes readable (at EOF) if the worker dies first
+        if not select.select([ready_read], [], [], self.ready_timeout)[0]:
+            logger.warning(f"Worker {pid} did not start accepting within {self.ready_timeout}s")
+        os.close(ready_read)
+        return pid
+    
+    def _run_worker(self, slot, worker_id, ready_fd):
+        """Body of a forked worker: serve until SIGTERM, finish open connections, exit"""
+        code = 1
+        try:
+            # Ctrl+C reaches the whole process group; the supervisor stops the workers
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            self.control.close()
+            
+            supervisor = SupervisorClient(self.control_path, worker_id)
+            metrics = PreforkWorkerMetrics(supervisor)
+            handler = type('MLHandler', (AdDetectionAPI,), {
+                'registry': self.registry,
+                'training_jobs': supervisor,
+                'metrics': metrics,
+                'slow_requests': SlowRequestLog(self.slow_request_ms)
+            })
+            server = PreforkWorkerHTTPServer(self.socket, handler, self.connections, slot,
+                                             workers=self.workers, max_queue=self.max_queue)
+            
+            def drain(signum, frame):
+                server.draining = True
+                # shutdown() waits for serve_forever, so it cannot run on this thread
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            signal.signal(signal.SIGTERM, drain)
+            
+            refresher = threading.Thread(target=self._refresh, args=(server, metrics), daemon=True)
+            refresher.start()
+            
+            os.write(ready_fd, b'1')
+            os.close(ready_fd)
+            server.serve_forever()
+            
+            server.executor.shutdown(wait=True)
+            try:
+                metrics.report(self.registry)
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"Worker {os.getpid()} could not report its final metrics: {e}")
+            code = 0
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} failed: {e}")
+        finally:
+            os._exit(code)
+    
+    def _refresh(self, server, metrics):
+        """Pick up feedback sent to siblings and report this worker's metrics, once a second"""
+        while not server.draining:
+            try:
+                self.registry.feedback.refresh()
+            except Exception as e:
+                logger.error(f"Feedback refresh failed: {e}")
+            try:
+                metrics.report(self.registry)
+            except (OSError, RuntimeError):
+                # The supervisor is busy, e.g. rolling out; the next report catches up
+                pass
+            time.sleep(1.0)
+    
+    def _serve_control(self, timeout):
+        """Answer workers' control requests for up to `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        while select.select([self.control], [], [], max(deadline - time.monotonic(), 0))[0]:
+            try:
+                conn, _ = self.control.accept()
+            except BlockingIOError:
+                continue
+            
+            with conn:
+                conn.settimeout(1.0)
+                try:
+                    with conn.makefile('rb') as request_file:
+                        request = json.loads(request_file.readline(self.max_control_message))
+                    reply = {'result': self._control_request(request)}
+                except ValueError as e:
+                    reply = {'error': str(e), 'invalid': True}
+                except Exception as e:
+                    logger.error(f"Control request failed: {e}")
+                    reply = {'error': str(e)}
+                try:
+                    conn.sendall(json_body(reply) + b'\n')
+                except OSError:
+                    pass
+    
+    def _control_request(self, request):
+        """Result of one worker request: a training submit or status, or a metrics report"""
+        op = request.get('op')
+        if op == 'submit':
+            return self.training_jobs.submit(request.get('search', False), request.get('n_jobs'),
+                                             request.get('max_rows'))
+        if op == 'job':
+            return self.training_jobs.get(request.get('job_id'))
+        if op == 'metrics':
+            worker_id = request.get('worker')
+            # A report can arrive after its worker has been retired
+            if worker_id not in self._retired_workers:
+                self._worker_metrics[worker_id] = request['snapshot']
+            if not request.get('total'):
+                return None
+            # The asking worker's own snapshot goes first, so its model state is shown
+            others = [snapshot for other_id, snapshot in self._worker_metrics.items() if other_id != worker_id]
+            retired = [self._retired_metrics] if self._retired_metrics is not None else []
+            return merge_snapshots([request['snapshot'], *others, *retired])
+        raise ValueError(f'Unknown control request: {op}')
+    
+    def _retire(self, worker_id):
+        """Fold an exited worker's last metrics into the totals kept for workers gone"""
+        self._retired_workers.add(worker_id)
+        snapshot = self._worker_metrics.pop(worker_id, None)
+        if snapshot is not None:
+            retired = [self._retired_metrics] if self._retired_metrics is not None else []
+            self._retired_metrics = merge_snapshots([*retired, retired_snapshot(snapshot)])
+    
+    def _worker_exited(self, pid, status):
+        slot, started, worker_id = self.children.pop(pid)
+        self.connections[slot] = IDLE_SLOT
+        self._retire(worker_id)
+        logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        
+        if time.monotonic() - started < self.min_uptime:
+            # Crashing on start, e.g. a bad model: do not fork in a tight loop
+            self._restart_delay = min(max(2 * self._restart_delay, 1.0), self.max_restart_delay)
+            self._serve_control(self._restart_delay)
+            if self._stop.is_set():
+                return
+        else:
+            self._restart_delay = 0.0
+        self._spawn()
+    
+    def _roll_out(self):
+        """Load the current model file, then replace the workers one at a time; False if it would not load"""
+        detector = self.registry.create_detector()
+        if not detector.load_model(self.registry.model_path):
+            logger.error("Model reload failed; workers keep serving the previous model")
+            return False
+        self.registry.publish(detector)
+        
+        for pid in list(self.children):
+            if self._stop.is_set():
+                break
+            self._spawn()
+            self._stop_worker(pid)
+        logger.info(f"Model version {self.registry.version} rolled out to {len(self.children)} workers")
+        return True
+    
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+    
+    def _stop_worker(self, pid, signal_sent=False):
+        """Drain a worker with SIGTERM, killing it after drain_timeout"""
+        slot, _, worker_id = self.children.pop(pid)
+        if not signal_sent:
+            self._signal(pid, signal.SIGTERM)
+        
+        deadline = time.monotonic() + self.drain_timeout
+        try:
+            while os.waitpid(pid, os.WNOHANG)[0] == 0:
+                if time.monotonic() > deadline:
+                    logger.warning(f"Worker {pid} did not drain within {self.drain_timeout}s, killing it")
+                    self._signal(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    break
+                # The draining worker reports its final metrics meanwhile
+                self._serve_control(0.05)
+        except ChildProcessError:
+            pass
+        self.connections[slot] = IDLE_SLOT
+        self._retire(worker_id)
+
+class MicroBatcher:
+    """Coalesces concurrent single-element requests into one batched forest call"""
+    
+    def __init__(self, registry, window_ms=2.0, max_batch=64, metrics=None):
+        self.registry = registry
+        self.metrics = metrics
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = []
+        self._flush_handle = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ml-batcher')
+    
+    async def submit(self, element_data):
+        """Queue one element and wait for its own predict_batch result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((element_data, future))
+        
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        
+        return await future
+    
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._score(batch))
+    
+    async def _score(self, batch):
+        loop = asyncio.get_running_loop()
+        elements = [element_data for element_data, _ in batch]
+        
+        try:
+            detector = self.registry.get()
+            if detector is None:
+                raise RuntimeError('Model not loaded')
+            timings = {}
+            results = await loop.run_in_executor(
+                self._executor, lambda: detector.predict_batch(elements, timings=timings)
+            )
+            if self.metrics is not None:
+                self.metrics.observe_batch(len(elements))
+                self.metrics.observe_stages(timings)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+class AsyncAdDetectionService:
+    """Asyncio variant of the ML service that micro-batches single-element requests
+    
+    Serves the threaded service's endpoints, except /batch_analyze_stream, with the
+    same responses; concurrent /analyze calls share one forest evaluation.
+    """
+    
+    max_header_lines = 100
+    max_body_size = AdDetectionAPI.max_body_size
+    
+    def __init__(self, host='localhost', port=8080, model_path='ad_detector_model.pkl',
+                 batch_window_ms=2.0, max_batch=64, cascade=False, slow_request_ms=250.0,
+                 dataset_path=None, max_training_rows=DEFAULT_MAX_TRAINING_ROWS):
+        self.host = host
+        self.port = port
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self.registry = ModelRegistry(model_path, cascade)
+        self.training_jobs = TrainingJobManager(self.registry, dataset_path, max_training_rows)
+        self.metrics = ServiceMetrics()
+        self.slow_requests = SlowRequestLog(slow_request_ms)
+        self.batcher = None
+        self.loop = None
+        self.server = None
+        self.server_thread = None
+        self._ready = threading.Event()
+        self._start_error = None
+    
+    def start_service(self):
+        """Start the asyncio server on its own event loop thread"""
+        try:
+            if not self.registry.load():
+                logger.info("No saved model found, starting background training...")
+                self.training_jobs.submit()
+            
+            self.server_thread = threading.Thread(target=self._run_loop)
+            self.server_thread.daemon = True
+            self.server_thread.start()
+            self._ready.wait()
+            
+            if self._start_error:
+                raise self._start_error
+            
+            logger.info(f"Async ML Detection Service started on {self.host}:{self.port} "
+                        f"(batch window {self.batch_window_ms} ms, max batch {self.max_batch})")
+            logger.info("API Endpoints:")
+            logger.info("  GET  /health - Health check")
+            logger.info("  GET  /metrics - Prometheus metrics")
+            logger.info("  GET  /analyze - Analyze single element (query params)")
+            logger.info("  POST /analyze - Analyze single element (JSON, micro-batched)")
+            logger.info("  POST /batch_analyze - Analyze multiple elements")
+            logger.info("  POST /analyze_page - Analyze a page's new and changed elements")
+            logger.info("  POST /match_urls - Match URLs against the extension's rules.json")
+            logger.info("  POST /feedback - Report a false positive or missed ad")
+            logger.info("  GET  /admin/profile?seconds=N - Sample stacks for N seconds (local clients only)")
+            logger.info("  GET  /admin/slow_requests - Recent requests over the slow-request threshold")
+            logger.info("  POST /train - Start background training job")
+            logger.info("  GET  /train/<job_id> - Training job status")
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to start service: {e}")
+            return False
+    
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+        try:
+            self.batcher = MicroBatcher(self.registry, self.batch_window_ms, self.max_batch, self.metrics)
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle_connection, self.host, self.port)
+            )
+        except Exception as e:
+            self._start_error = e
+            self._ready.set()
+            return
+        
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            
+            # Drop open keep-alive connections before closing the loop
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.batcher.close()
+            self.loop.close()
+    
+    def stop_service(self):
+        """Stop the asyncio server and its event loop"""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.server_thread.join(timeout=5)
+            self.training_jobs.shutdown()
+            self.registry.feedback.close()
             logger.info("ML Detection Service stopped")
     
     def is_running(self):
         """Check if service is running"""
         return self.server_thread and self.server_thread.is_alive()
+    
+    async def handle_connection(self, reader, writer):
+        """Serve keep-alive HTTP/1.1 requests on one connection"""
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                
+                method, path, headers, body = request
+                if body is None:
+                    # Body left unread, so the connection cannot be reused
+                    self.write_response(writer, 413, {'error': f'Request body exceeds {self.max_body_size} bytes'}, False)
+                    break
+                
+                self.metrics.request_started()
+                started = time.perf_counter()
+                timings = {}
+                shape = {'bytes': len(body), 'content_type': headers.get('content-type')}
+                status = 500
+                try:
+                    if urlparse(path).path.startswith('/admin/') \
+                            and not is_admin_client(writer.get_extra_info('peername')[0]):
+                        status, response = 403, {'error': 'Admin endpoints are only served to local clients'}
+                    else:
+                        status, response = await self.dispatch(method, path, headers, body, timings, shape)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    self.write_response(writer, status, response, keep_alive, timings)
+                    await writer.drain()
+                finally:
+                    seconds = time.perf_counter() - started
+                    endpoint = endpoint_label(urlparse(path).path)
+                    self.metrics.request_finished(method, endpoint, status, seconds)
+                    self.metrics.observe_stages(timings)
+                    self.slow_requests.record(method, endpoint, status, seconds, timings, shape)
+                
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the service is shutting down
+            pass
+        except ValueError:
+            self.write_response(writer, 400, {'error': 'Malformed request'}, False)
+        finally:
+            writer.close()
+    
+    async def read_request(self, reader):
+        """Parse one request; returns None when the client closed the connection
+        
+        Bodies come with a Content-Length or chunked. One over max_body_size is
+        not read (in full) and comes back as None.
+        """
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        
+        headers = {}
+        for _ in range(self.max_header_lines):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError('Too many headers')
+        
+        transfer_encoding = headers.get('transfer-encoding', '').lower()
+        if transfer_encoding:
+            # Only chunked framing can be read without the server guessing the body's end
+            if transfer_encoding.rsplit(',', 1)[-1].strip() != 'chunked':
+                raise ValueError(f'Unsupported Transfer-Encoding: {transfer_encoding}')
+            return method, target, headers, await self.read_chunked_body(reader)
+        
+        content_length = int(headers.get('content-length', 0))
+        if content_length < 0:
+            raise ValueError('Negative Content-Length')
+        if content_length > self.max_body_size:
+            return method, target, headers, None
+        
+        body = await reader.readexactly(content_length) if content_length else b''
+        return method, target, headers, body
+    
+    async def read_chunked_body(self, reader):
+        """Read a chunked request body; None once it grows past max_body_size"""
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailer fields up to the blank line ending the body
+                while await reader.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return bytes(body)
+            if size < 0 or len(body) + size > self.max_body_size:
+                return None
+            body += await reader.readexactly(size)
+            await reader.readline()
+    
+    async def dispatch(self, method, target, headers, body, timings, shape=None):
+        """Route a request to its handler
+        
+        Returns (status, response); the response is JSON-able data or an
+        EncodedBody. Decode and scoring stage times are added to timings, and
+        the number of elements scored to shape if it is given.
+        """
+        parsed_path = urlparse(target)
+        shape = {} if shape is None else shape
+        
+        if parsed_path.path == '/health' and method == 'GET':
+            return 200, health_response(self.registry)
+        
+        if parsed_path.path == '/metrics' and method == 'GET':
+            return 200, EncodedBody(self.metrics.render(self.registry).encode('utf-8'), METRICS_CONTENT_TYPE)
+        
+        if parsed_path.path == '/match_urls' and method == 'POST':
+            return match_urls_response(body, timings)
+        
+        if parsed_path.path == '/admin/profile' and method == 'GET':
+            status, data = await asyncio.get_running_loop().run_in_executor(
+                None, profile_response, parsed_path.query
+            )
+            if status == 200:
+                return 200, EncodedBody(data.encode('utf-8'), 'text/plain; charset=utf-8')
+            return status, data
+        
+        if parsed_path.path == '/admin/slow_requests' and method in ('GET', 'POST'):
+            return slow_requests_response(self.slow_requests, method, body)
+        
+        if parsed_path.path == '/analyze_page' and method == 'POST':
+            return await asyncio.get_running_loop().run_in_executor(
+                None, page_analysis_response, self.registry, body, timings
+            )
+        
+        if parsed_path.path == '/feedback' and method == 'POST':
+            # Logs to disk and refits the correction; keep both off the loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, feedback_response, self.registry, body, timings
+            )
+        
+        if parsed_path.path == '/train' and method in ('GET', 'POST'):
+            # Starting the training process blocks for a moment; GET is kept
+            # for older clients and starts a default job like the threaded server
+            return await asyncio.get_running_loop().run_in_executor(
+                None, training_response, self.training_jobs, body if method == 'POST' else b''
+            )
+        
+        if parsed_path.path.startswith('/train/') and method == 'GET':
+            return training_status_response(self.training_jobs, parsed_path.path[len('/train/'):])
+        
+        if parsed_path.path not in ('/analyze', '/batch_analyze') or method not in ('GET', 'POST'):
+            return 404, {'error': 'Endpoint not found'}
+        
+        try:
+            if method == 'GET' and parsed_path.path == '/analyze':
+                query_params = parse_qs(parsed_path.query)
+                payload = {key: values[0] for key, values in query_params.items() if values}
+                if not payload:
+                    return 400, {'error': 'No element data provided'}
+            elif parsed_path.path == '/batch_analyze' and method == 'POST':
+                content_type = headers.get('content-type')
+                stage = 'columnar_decode' if is_columnar(content_type) else 'json_decode'
+                payload = timed(timings, stage, decode_batch_request, body, content_type)
+            elif method == 'POST':
+                payload = timed(timings, 'json_decode', json.loads, body)
+            else:
+                return 404, {'error': 'Endpoint not found'}
+        except ValueError:
+            # JSONDecodeError and UnicodeDecodeError are ValueErrors too
+            return 400, {'error': 'Invalid request data'}
+        
+        if not self.registry.is_loaded:
+            return 503, {'error': 'Model not loaded'}
+        
+        try:
+            if parsed_path.path == '/analyze':
+                shape['elements'] = 1
+                result = await self.batcher.submit(payload)
+                return 200, element_response(result)
+            
+            # Whole batches are already one forest call; score them off the loop
+            detector = self.registry.get()
+            self.metrics.observe_batch(len(payload))
+            shape['elements'] = len(payload)
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: detector.predict_batch(payload, timings=timings)
+            )
+            if wants_columnar(headers.get('accept')):
+                body = timed(timings, 'columnar_encode', columnar_batch_response, results)
+                return 200, EncodedBody(body, columnar_format.CONTENT_TYPE)
+            return 200, batch_response(results)
+            
+        except Exception as e:
+            logger.error(f"Analysis error: {e}")
+            return 500, {'error': str(e)}
+    
+    def write_response(self, writer, status, data, keep_alive=True, timings=None):
+        """Write a JSON (or already encoded) response with Content-Length"""
+        if isinstance(data, EncodedBody):
+            body, content_type = data
+        else:
+            body = timed(timings if timings is not None else {}, 'json_encode', json_body, data)
+            content_type = 'application/json'
+        
+        reason = BaseHTTPRequestHandler.responses.get(status, ('',))[0]
+        head = (
+            f'HTTP/1.1 {status} {reason}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+        )
+        writer.write(head.encode('latin-1') + body)
 
 def main():
     """Main function to run the service"""
@@ -278,15 +1902,57 @@ def main():
     parser.add_argument('--host', default='localhost', help='Host to bind to')
     parser.add_argument('--port', type=int, default=8080, help='Port to bind to')
     parser.add_argument('--daemon', action='store_true', help='Run as daemon')
+    parser.add_argument('--model-path', default='ad_detector_model.pkl', help='Model file to load at startup')
+    parser.add_argument('--workers', type=int, default=8, help='Worker threads serving requests')
+    parser.add_argument('--max-queue', type=int, default=64, help='Connections allowed to wait for a worker before 503')
+    parser.add_argument('--mode', choices=['threaded', 'async', 'prefork'], default='threaded',
+                        help='threaded worker pool, asyncio with micro-batched /analyze, '
+                             'or a threaded pool in each of several forked processes')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Prefork mode: worker processes (default: one per CPU)')
+    parser.add_argument('--batch-window-ms', type=float, default=2.0,
+                        help='Async mode: how long to collect /analyze calls into one batch')
+    parser.add_argument('--max-batch', type=int, default=64,
+                        help='Async mode: score a batch as soon as this many calls are waiting')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Answer confident elements from the rule table and only send the rest to the forest')
+    parser.add_argument('--slow-request-ms', type=float, default=250.0,
+                        help='Requests slower than this are kept in the /admin/slow_requests log')
+    parser.add_argument('--dataset-path', default=None,
+                        help='Labelled CSV/JSONL element log or feature store to train on (default: synthetic data)')
+    parser.add_argument('--max-training-rows', type=int, default=DEFAULT_MAX_TRAINING_ROWS,
+                        help='Rows sampled from the training data at most, to bound training memory')
     
     args = parser.parse_args()
     
     # Create and start service
-    service = AdDetectionService(args.host, args.port)
+    if args.mode == 'prefork':
+        service = PreforkAdDetectionService(args.host, args.port, args.model_path,
+                                            processes=args.processes, workers=args.workers,
+                                            max_queue=args.max_queue, cascade=args.cascade,
+                                            slow_request_ms=args.slow_request_ms,
+                                            dataset_path=args.dataset_path,
+                                            max_training_rows=args.max_training_rows)
+    elif args.mode == 'async':
+        service = AsyncAdDetectionService(args.host, args.port, args.model_path,
+                                          batch_window_ms=args.batch_window_ms,
+                                          max_batch=args.max_batch, cascade=args.cascade,
+                                          slow_request_ms=args.slow_request_ms,
+                                          dataset_path=args.dataset_path,
+                                          max_training_rows=args.max_training_rows)
+    else:
+        service = AdDetectionService(args.host, args.port, args.model_path,
+                                     workers=args.workers, max_queue=args.max_queue, cascade=args.cascade,
+                                     slow_request_ms=args.slow_request_ms,
+                                     dataset_path=args.dataset_path,
+                                     max_training_rows=args.max_training_rows)
     
     if service.start_service():
         try:
-            if args.daemon:
+            if args.mode == 'prefork':
+                # The supervisor forks its workers, which it only does on the main thread
+                service.supervise()
+            elif args.daemon:
                 # Run indefinitely
                 while True:
                     time.sleep(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Regression tests for feature extraction, the feature schema and the prediction cache
+"""
+
+import numpy as np
+import pytest
+
+from ml_detector import (FEATURE_COLUMNS, KEYWORD_MATCHER, TEXT_FEATURE_COLUMNS, AdvancedAdDetector,
+                         FeatureSchema, PredictionCache)
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('model') / 'model.pkl')
+    AdvancedAdDetector(rules_path=None).train_model(model_path=path)
+    return path
+
+def test_schema_column_order():
+    schema = FeatureSchema()
+    
+    assert schema.names == [name for name, _ in FEATURE_COLUMNS + TEXT_FEATURE_COLUMNS]
+    assert schema.text_columns == list(range(len(FEATURE_COLUMNS), len(schema)))
+    
+    matrix, valid, _ = AdvancedAdDetector(rules_path=None).extract_feature_matrix(
+        [{'description': 'x' * 42, 'has_ad_badge': True}]
+    )
+    assert valid.all()
+    assert matrix[0, schema.index['description_length']] == 42
+    assert matrix[0, schema.index['has_ad_badge']] == 1
+    assert matrix[0, schema.index['is_promoted']] == 0
+
+def test_schema_file_round_trip(tmp_path, model_path):
+    assert FeatureSchema.path_for(str(tmp_path / 'model.pkl')) == str(tmp_path / 'model.schema.json')
+    
+    schema = FeatureSchema(FEATURE_COLUMNS)
+    schema.save(str(tmp_path / 'model.schema.json'))
+    assert FeatureSchema.load(str(tmp_path / 'model.schema.json')).columns == schema.columns
+    
+    detector = AdvancedAdDetector(rules_path=None)
+    detector.load_model(model_path, prefer_packed=False)
+    assert detector.schema.columns == FeatureSchema.load(FeatureSchema.path_for(model_path)).columns
+    assert detector.model.n_features_in_ == len(detector.schema)
+
+def test_incompatible_schema_is_rejected():
+    with pytest.raises(ValueError):
+        FeatureSchema(FEATURE_COLUMNS[:-1])
+
+def test_batch_isolates_element_errors(model_path):
+    detector = AdvancedAdDetector(rules_path=None)
+    detector.load_model(model_path)
+    elements = [{'title': 'cooking show'}, {'view_count': 'many'}, None, {'title': 'Sponsored'}]
+    
+    matrix, valid, errors = detector.extract_feature_matrix(elements)
+    
+    assert list(valid) == [True, False, False, True]
+    assert sorted(errors) == [1, 2]
+    assert matrix[3, detector.schema.index['has_ad_keywords']] == 1
+    
+    results = detector.predict_batch(elements)
+    assert ['error' in result for result in results] == [False, True, True, False]
+    assert all(0.0 <= result['confidence'] <= 1.0 for result in results if 'error' not in result)
+
+@pytest.mark.parametrize('text, terms', [
+    ('Made for download, read more', set()),
+    ('a nomad adapts', set()),
+    ('Skip AD!', {'ad'}),
+    ('No ads, just sponsored-content', {'ad', 'sponsored'}),
+    ('Paid promotions', {'paid', 'promotion'}),
+    ('', set())
+])
+def test_keywords_match_whole_words(text, terms):
+    assert KEYWORD_MATCHER.find(text) == terms
+
+def test_cache_entries_expire_with_model_version():
+    cache = PredictionCache()
+    key = PredictionCache.key_for({'title': 'Sponsored'})
+    cache.put(key, 1, (0.9, ['Contains ad keywords']))
+    
+    assert cache.get(key, 1) == (0.9, ['Contains ad keywords'])
+    assert cache.get(key, 2) is None
+    assert cache.get(key, 1) is None
+
+def test_model_change_invalidates_cached_predictions(model_path):
+    detector = AdvancedAdDetector(rules_path=None)
+    detector.load_model(model_path)
+    element = {'title': 'Sponsored', 'is_promoted': True}
+    
+    detector.predict_batch([element])
+    detector.predict_batch([element])
+    assert detector.cache.hits == 1
+    
+    version = detector.model_version
+    detector.predictions_changed()
+    detector.predict_batch([element])
+    
+    assert detector.model_version != version
+    assert detector.cache.hits == 1
+    assert detector.cache.misses == 2
+
+def test_model_versions_differ_across_detectors(model_path):
+    first, second = AdvancedAdDetector(rules_path=None), AdvancedAdDetector(rules_path=None)
+    first.load_model(model_path)
+    second.load_model(model_path)
+    
+    assert first.model_version != second.model_version
+    assert np.array_equal(first.forest.threshold, second.forest.threshold)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the hashed text features
+"""
+
+import json
+
+import numpy as np
+
+from ml_detector import AdvancedAdDetector, FeatureStore
+from text_features import TextHasher
+
+def test_trailing_row_without_text():
+    features = TextHasher().transform([{'title': 'skip ad now'}, {'view_count': 5}, {'title': '!!!'}])
+    
+    assert features.shape == (3, TextHasher().width)
+    assert np.allclose(features.sum(axis=1), [1.0, 0.0, 0.0])
+
+def test_ingest_log_ending_in_row_without_text(tmp_path):
+    log_path = tmp_path / 'log.jsonl'
+    log_path.write_text(json.dumps({'title': 'Sponsored', 'is_ad': True}) + '\n'
+                        + json.dumps({'view_count': 5, 'is_ad': False}) + '\n')
+    
+    report = AdvancedAdDetector().ingest_training_log(str(log_path), str(tmp_path / 'store'))
+    
+    assert report.rows_ingested == 2
+    _, X, y = FeatureStore.open(str(tmp_path / 'store'))
+    assert X.shape[0] == 2 and list(y) == [True, False]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Text Features for YouTube Ad Blocker Pro
+Stateless hashed word n-gram features for element titles and descriptions,
+computed a batch at a time with numpy and no fitted vocabulary
+"""
+
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+# Element fields that are hashed, each into its own hash space
+TEXT_FIELDS = ('title', 'description')
+
+# Columns the projected text features occupy in a feature schema
+TEXT_FEATURE_WIDTH = 64
+
+# Lowercases ASCII letters, keeps digits and non-ASCII bytes (so words in
+# other scripts survive as UTF-8 tokens) and maps everything else to a space
+_TOKEN_TABLE = bytes(
+    c + 32 if 65 <= c <= 90 else c if (97 <= c <= 122 or 48 <= c <= 57 or c >= 128) else 32
+    for c in range(256)
+)
+
+# Odd 64-bit multipliers for combining and spreading hashes
+_BIGRAM_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_BUCKET_MULTIPLIERS = np.array([0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+class HashedText(namedtuple('HashedText', ['indptr', 'indices', 'data', 'n_features'])):
+    """A batch of hashed n-gram counts in CSR layout, one row per element; duplicates are summed"""
+    
+    @property
+    def n_rows(self):
+        return len(self.indptr) - 1
+    
+    def row_ids(self):
+        return np.repeat(np.arange(self.n_rows), np.diff(self.indptr))
+
+class TextHasher:
+    """Hashing vectorizer for element text, projected to a fixed number of columns"""
+    
+    def __init__(self, width=TEXT_FEATURE_WIDTH, n_features=2 ** 20, ngrams=2, max_chars=2000,
+                 batch_char_budget=200000, min_chars=200):
+        if n_features & (n_features - 1):
+            raise ValueError('n_features must be a power of two')
+        self.width = width
+        self.n_features = n_features
+        self.ngrams = ngrams
+        self.max_chars = max_chars
+        self.batch_char_budget = batch_char_budget
+        self.min_chars = min_chars
+        # One crc32 starting value per field, so a word in a title and in a
+        # description hash apart
+        self._seeds = [zlib.crc32(field.encode('ascii')) for field in TEXT_FIELDS]
+        self.truncated = 0
+    
+    def char_limit(self, elements):
+        """Characters hashed per field for each element of this batch"""
+        total = 0
+        for element in elements:
+            for field in TEXT_FIELDS:
+                text = element.get(field) if isinstance(element, dict) else None
+                if isinstance(text, str):
+                    total += min(len(text), self.max_chars)
+        if total <= self.batch_char_budget or not elements:
+            return self.max_chars
+        return max(self.min_chars, min(self.max_chars, self.batch_char_budget // len(elements)))
+    
+    def hash_batch(self, elements):
+        """HashedText for a batch of element dicts; non-dicts and non-text fields hash to nothing"""
+        limit = self.char_limit(elements)
+        hashes = []
+        # First token of every (element, field) run; bigrams never span two
+        starts = []
+        row_lengths = np.zeros(len(elements), dtype=np.int64)
+        truncated = 0
+        
+        for i, element in enumerate(elements):
+            if not isinstance(element, dict):
+                continue
+            count = 0
+            for field, seed in zip(TEXT_FIELDS, self._seeds):
+                text = element.get(field)
+                if not isinstance(text, str) or not text:
+                    continue
+                if len(text) > limit:
+                    text = text[:limit]
+                    truncated += 1
+                tokens = text.encode('utf-8', 'ignore').translate(_TOKEN_TABLE).split()
+                if tokens:
+                    starts.append(len(hashes))
+                    hashes.extend([zlib.crc32(token, seed) for token in tokens])
+                    count += len(tokens)
+            row_lengths[i] = count
+        self.truncated += truncated
+        
+        # Column n holds the (n+1)-gram ending at each word. It is kept if none
+        # of its words after the first starts a run. Reading the kept entries
+        # row-major leaves them in word order, and so grouped by element.
+        first = np.zeros(len(hashes), dtype=bool)
+        first[starts] = True
+        grams = np.empty((len(hashes), self.ngrams), dtype=np.uint64)
+        valid = np.zeros((len(hashes), self.ngrams), dtype=bool)
+        grams[:, 0] = hashes
+        valid[:, 0] = True
+        for n in range(1, self.ngrams):
+            grams[n:, n] = grams[n - 1:-1, n - 1] * _BIGRAM_MULTIPLIER ^ grams[n:, 0]
+            valid[n:, n] = valid[n - 1:-1, n - 1] & ~first[n:]
+        
+        indices = (grams[valid] & np.uint64(self.n_features - 1)).astype(np.int64)
+        # Entries per element: kept n-grams summed over each element's words
+        kept = np.zeros(len(hashes) + 1, dtype=np.int64)
+        np.cumsum(valid.sum(axis=1), out=kept[1:])
+        word_bounds = np.zeros(len(elements) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=word_bounds[1:])
+        return HashedText(kept[word_bounds], indices, np.ones(len(indices), dtype=np.float32), self.n_features)
+    
+    def project(self, hashed):
+        """Dense (rows, width) float32 shares of each row's n-grams per column"""
+        # Two (row, column) cells per entry, each taking half its count; two
+        # n-grams rarely collide in both
+        spread = hashed.indices.astype(np.uint64)[:, None] * _BUCKET_MULTIPLIERS
+        cells = (spread >> np.uint64(40)).astype(np.int64) % self.width + (hashed.row_ids() * self.width)[:, None]
+        weights = np.repeat(hashed.data * 0.5, len(_BUCKET_MULTIPLIERS))
+        dense = np.bincount(cells.ravel(), weights=weights, minlength=hashed.n_rows * self.width)
+        dense = dense.reshape(hashed.n_rows, self.width)
+        
+        totals = np.bincount(hashed.row_ids(), weights=hashed.data, minlength=hashed.n_rows)
+        totals[totals == 0] = 1.0
+        return (dense / totals[:, None]).astype(np.float32)
+    
+    def transform(self, elements):
+        return self.project(self.hash_batch(elements))
+    
+    def stats(self):
+        return {
+            'width': self.width,
+            'n_features': self.n_features,
+            'ngrams': self.ngrams,
+            'max_chars': self.max_chars,
+            'batch_char_budget': self.batch_char_budget,
+            'truncated_fields': self.truncated
+        }
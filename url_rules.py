@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+URL Rule Engine for YouTube Ad Blocker Pro
+Compiles the extension's declarativeNetRequest rules.json so the Python service
+can match URLs against the same block and allow rules
+"""
+
+import json
+import os
+import re
+import threading
+
+# declarativeNetRequest applies these to every resource type but main_frame
+# when a rule lists no resourceTypes
+DEFAULT_EXCLUDED_RESOURCE_TYPES = frozenset({'main_frame'})
+
+# Tie-break between matching rules of equal priority, highest first
+ACTION_PRECEDENCE = {
+    'allow': 5,
+    'allowAllRequests': 4,
+    'block': 3,
+    'upgradeScheme': 2,
+    'redirect': 1,
+    'modifyHeaders': 0
+}
+
+# `^` matches one character that is not a letter, digit or one of _ - . %,
+# or the end of the URL
+SEPARATOR_PATTERN = r'(?:[^a-z0-9_\-.%]|$)'
+
+# `||` anchors at the start of the host or of any subdomain label
+DOMAIN_ANCHOR_PATTERN = r'^[a-z][a-z0-9+.\-]*://(?:[^/?#@]*@)?(?:[^/?#]*\.)?'
+
+_HOST_RE = re.compile(r'^[a-z][a-z0-9+.\-]*://(?:[^/?#@]*@)?([^/?#:]*)')
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Characters that end the host part of a `||` filter
+_HOST_END = '^/:*|?'
+
+def compile_url_filter(url_filter, case_sensitive=False):
+    """Translate a urlFilter into a compiled regular expression"""
+    pattern = url_filter
+    prefix = suffix = ''
+    if pattern.startswith('||'):
+        prefix, pattern = DOMAIN_ANCHOR_PATTERN, pattern[2:]
+    elif pattern.startswith('|'):
+        prefix, pattern = '^', pattern[1:]
+    if pattern.endswith('|'):
+        suffix, pattern = '$', pattern[:-1]
+    
+    parts = []
+    for char in pattern:
+        if char == '*':
+            parts.append('.*')
+        elif char == '^':
+            parts.append(SEPARATOR_PATTERN)
+        else:
+            parts.append(re.escape(char))
+    
+    return re.compile(prefix + ''.join(parts) + suffix, 0 if case_sensitive else re.IGNORECASE)
+
+def host_of(url):
+    """Lowercased host of an absolute URL, or '' if it has none"""
+    match = _HOST_RE.match(url.lower())
+    return match.group(1) if match else ''
+
+def _domain_matches(host, domains):
+    """True if host is one of domains or a subdomain of one"""
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+def _indexed_host(url_filter):
+    """Host of a `||host^` or `||host/...` filter whose last label is complete, else None"""
+    if not url_filter.startswith('||'):
+        return None
+    rest = url_filter[2:]
+    end = min((rest.find(c) for c in _HOST_END if c in rest), default=len(rest))
+    host = rest[:end].lower()
+    if not host or end == len(rest) or rest[end] not in '^/:' or not re.fullmatch(r'[a-z0-9.\-]+', host):
+        return None
+    return host.strip('.')
+
+def _index_token(url_filter):
+    """Longest literal token the filter forces to appear as a whole token of the URL, or None
+    
+    A token only counts if the filter bounds it on both sides by a literal
+    non-alphanumeric character, a `^` or an anchor; next to `*` or an
+    unanchored end the URL token could be longer.
+    """
+    pattern = url_filter.lower()
+    best = None
+    for match in _TOKEN_RE.finditer(pattern):
+        start, end = match.span()
+        before = pattern[start - 1] if start else ''
+        after = pattern[end] if end < len(pattern) else ''
+        if before in ('', '*') or after in ('', '*'):
+            continue
+        if best is None or len(match.group()) > len(best):
+            best = match.group()
+    return best
+
+class CompiledRule:
+    """One rules.json entry with its condition compiled for matching"""
+    
+    __slots__ = ('id', 'priority', 'action', 'rank', 'url_filter', 'case_sensitive', '_regex', 'resource_types',
+                 'excluded_resource_types', 'request_domains', 'excluded_request_domains')
+    
+    def __init__(self, rule):
+        condition = rule.get('condition', {})
+        self.case_sensitive = condition.get('isUrlFilterCaseSensitive', False)
+        
+        self.id = rule['id']
+        self.priority = rule.get('priority', 1)
+        self.action = rule['action']['type']
+        # Highest rank wins among matching rules
+        self.rank = (self.priority, ACTION_PRECEDENCE.get(self.action, -1))
+        self.url_filter = condition.get('urlFilter')
+        # urlFilters compile on first use: most rules in a large list are never
+        # a candidate, and compiling them all dominates load time
+        self._regex = None
+        if self.url_filter is None and 'regexFilter' in condition:
+            self._regex = re.compile(condition['regexFilter'], 0 if self.case_sensitive else re.IGNORECASE)
+        
+        self.resource_types = frozenset(condition['resourceTypes']) if 'resourceTypes' in condition else None
+        self.excluded_resource_types = frozenset(condition.get(
+            'excludedResourceTypes', DEFAULT_EXCLUDED_RESOURCE_TYPES if self.resource_types is None else ()
+        ))
+        self.request_domains = [d.lower() for d in condition.get('requestDomains', [])]
+        self.excluded_request_domains = [d.lower() for d in condition.get('excludedRequestDomains', [])]
+    
+    def matches(self, url, host, resource_type=None):
+        if resource_type is not None:
+            if self.resource_types is not None and resource_type not in self.resource_types:
+                return False
+            if resource_type in self.excluded_resource_types:
+                return False
+        if self.request_domains and not _domain_matches(host, self.request_domains):
+            return False
+        if self.excluded_request_domains and _domain_matches(host, self.excluded_request_domains):
+            return False
+        regex = self.regex
+        return regex is None or regex.search(url) is not None
+    
+    @property
+    def regex(self):
+        if self._regex is None and self.url_filter is not None:
+            self._regex = compile_url_filter(self.url_filter, self.case_sensitive)
+        return self._regex
+    
+    def to_dict(self):
+        return {
+            'rule_id': self.id,
+            'action': self.action,
+            'priority': self.priority,
+            'url_filter': self.url_filter
+        }
+
+class UrlRuleEngine:
+    """Indexed matcher for declarativeNetRequest rules
+    
+    `||host^` style rules live in a trie keyed by reversed host labels, so a
+    URL only visits the nodes for its own host suffixes. Other rules are keyed
+    by one literal token that every matching URL must contain. Only the rules
+    those lookups return are checked with their regex, which keeps the cost per
+    URL roughly flat as the rule list grows; rules with neither key are
+    checked for every URL.
+    """
+    
+    def __init__(self, rules):
+        self.rules = [CompiledRule(rule) for rule in rules]
+        self._trie = {}
+        self._tokens = {}
+        self._generic = []
+        
+        for rule in self.rules:
+            host = _indexed_host(rule.url_filter) if rule.url_filter else None
+            token = _index_token(rule.url_filter) if rule.url_filter and host is None else None
+            if host:
+                node = self._trie
+                for label in reversed(host.split('.')):
+                    node = node.setdefault(label, {})
+                node.setdefault(None, []).append(rule)
+            elif token:
+                self._tokens.setdefault(token, []).append(rule)
+            else:
+                self._generic.append(rule)
+    
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+    
+    def candidates(self, url, host):
+        """Rules that could match url; a superset of the rules that do"""
+        found = list(self._generic)
+        
+        node = self._trie
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        
+        if self._tokens:
+            for token in set(_TOKEN_RE.findall(url.lower())):
+                found.extend(self._tokens.get(token, ()))
+        return found
+    
+    def match(self, url, resource_type=None):
+        """Winning rule for url as a dict, or None if no rule matches
+        
+        Highest priority wins; at equal priority allow beats block, as in the
+        browser. Without a resource_type, resource type conditions are ignored.
+        """
+        if not url:
+            return None
+        host = host_of(url)
+        best = None
+        for rule in self.candidates(url, host):
+            if (best is None or rule.rank > best.rank) and rule.matches(url, host, resource_type):
+                best = rule
+        return best.to_dict() if best is not None else None
+    
+    def match_urls(self, urls, resource_type=None):
+        """match for a batch of URLs; repeated URLs are matched once"""
+        seen = {}
+        results = []
+        for url in urls:
+            if url not in seen:
+                seen[url] = self.match(url, resource_type)
+            results.append(seen[url])
+        return results
+    
+    def is_blocked(self, url, resource_type=None):
+        rule = self.match(url, resource_type)
+        return rule is not None and rule['action'] == 'block'
+    
+    def stats(self):
+        def count(node):
+            return sum(len(value) if key is None else count(value) for key, value in node.items())
+        return {
+            'rules': len(self.rules),
+            'domain_indexed': count(self._trie),
+            'token_indexed': sum(len(rules) for rules in self._tokens.values()),
+            'unindexed': len(self._generic)
+        }
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def load_rule_engine(path):
+    """Shared engine for a rules file, rebuilt only when the file changes; None if it is missing"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    
+    key = os.path.abspath(path)
+    with _engines_lock:
+        cached = _engines.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = _engines[key] = (mtime, UrlRuleEngine.from_file(path))
+        return cached[1]